@@ -31,33 +31,71 @@ import struct
 import datetime
 import endian
 import sys, traceback
+from collections import namedtuple
+from checksum import checksumEngine, checksumOf
 from targets import RELEASE_DATE_LENGTH, APP_NAME_LENGTH
 
 ubootTag = 'U-Boot'
 uimageTag = 'uImage'
 versionTag = 0xB11DDA7E # build date
 
+# uImage header; always big endian
+UIMAGE_MAGIC = 0x27051956
+UIMAGE_HEADER = '>LLLLLLLBBBB32s'
+UIMAGE_HEADER_SIZE = struct.calcsize(UIMAGE_HEADER)
+uimageHeader = namedtuple('uimageHeader', 'ih_magic ih_hcrc ih_time ih_size ih_load ih_ep ih_dcrc '
+						  'ih_os ih_arch ih_type ih_comp ih_name')
+
+class uimageError(Exception):
+	pass
+
+def uimageHead(image): # uimageHeader from the start of image or None if it is not a uImage
+	head = bytes(bytearray(image[:UIMAGE_HEADER_SIZE]))
+	if len(head) < UIMAGE_HEADER_SIZE:
+		return None
+	header = uimageHeader._make(struct.unpack(UIMAGE_HEADER, head))
+	return header if header.ih_magic == UIMAGE_MAGIC else None
+
+def headerCrc(image): # crc of the header taken with ih_hcrc zeroed
+	head = bytes(bytearray(image[:UIMAGE_HEADER_SIZE]))
+	return checksumOf('crc32', head[:4] + '\0'*4 + head[8:])
+
+def checkUimage(segments):
+	'''
+	Header of the uImage at the start of a segment map. Raises uimageError
+	if it is not a uImage, either crc is wrong or the data is cut short.
+	'''
+	head = segments.read(0, UIMAGE_HEADER_SIZE) if segments.end() >= UIMAGE_HEADER_SIZE else ''
+	header = uimageHead(head)
+	if header is None:
+		raise uimageError('Not a uImage')
+	if headerCrc(head) != header.ih_hcrc:
+		raise uimageError('Bad uImage header crc')
+	if UIMAGE_HEADER_SIZE + header.ih_size > segments.end():
+		raise uimageError('uImage data cut short: %d of %d bytes'%(segments.end() - UIMAGE_HEADER_SIZE, header.ih_size))
+	if segments.crc32(UIMAGE_HEADER_SIZE, UIMAGE_HEADER_SIZE + header.ih_size) != header.ih_dcrc:
+		raise uimageError('Bad uImage data crc')
+	return header
+
 def dumpUimage(file):
-	image = map(ord, open(file, 'rb').read(64)) # header is 64 bytes
-	print >>sys.stderr, 'magic: %X'%endian.long(image[0:4])
-	print >>sys.stderr, 'hcrc: %X'%endian.long(image[4:8])
-	print >>sys.stderr, 'time: %X'%endian.long(image[8:12])
-	print >>sys.stderr, 'size: %X'%endian.long(image[12:16]) # size of image following header
-	print >>sys.stderr, 'load: %X'%endian.long(image[16:20])
-	print >>sys.stderr, 'ep: %X'%endian.long(image[20:24])
-	print >>sys.stderr, 'dcrc: %X'%endian.long(image[24:28])
-	print >>sys.stderr, 'os: %X'%image[28]
-	print >>sys.stderr, 'arch: %X'%image[29]
-	print >>sys.stderr, 'type: %X'%image[30]
-	print >>sys.stderr, 'comp: %X'%image[31]
-	print >>sys.stderr, 'name: %s'%''.join(map(chr, image[32:])).strip()
+	with open(file, 'rb') as f:
+		head = f.read(UIMAGE_HEADER_SIZE)
+		header = uimageHead(head)
+		if header is None:
+			print >>sys.stderr, 'not a uImage'
+			return
+		crc = checksumEngine('crc32')
+		for block in iter(lambda: f.read(1024 * 1024), ''):
+			crc.update(block)
+	for name in header._fields[:-1]:
+		print >>sys.stderr, '%s: %X'%(name[3:], getattr(header, name))
+	print >>sys.stderr, 'name: %s'%header.ih_name.rstrip('\0')
+	print >>sys.stderr, 'date: %s'%extractUimageDate(head)
+	print >>sys.stderr, 'header crc: %s'%('ok' if headerCrc(head) == header.ih_hcrc else 'bad')
+	print >>sys.stderr, 'data crc: %s'%('ok' if crc.digest() == header.ih_dcrc else 'bad')
 
 def listfind(source, match): # find string match in source list
-	m = map(ord, match)
-	offset = [i for i in range(len(source)) if source[i:i+len(m)] == m]
-	if offset:
-		return offset[0]
-	return -1
+	return bytearray(source).find(match)
 
 # Version and date relationships
 YMDHMS = "%Y-%m-%d %H:%M:%S"	# metric format
@@ -105,19 +143,18 @@ def currentDate():
 
 # uboot and uimage date to version
 def extractUbootDate(image): # must find string inside binary and convert
-	offset = listfind(image, ubootTag+' 2')
+	offset = image.find(ubootTag+' 2')
 	if offset != -1:
-		imgdate = image[offset:]
-		openParen = listfind(imgdate, '(')
-		closeParen = listfind(imgdate, ')')
-		date = ''.join(map(chr,imgdate[openParen+1:closeParen]))
+		openParen = image.find('(', offset)
+		closeParen = image.find(')', openParen)
+		date = str(image[openParen+1:closeParen])
 		d = datetime.datetime.strptime(date, MDY_HMS)
 		return dateString(d.year, d.month, d.day, d.hour, d.minute, d.second)
 	return dateString(*(buildDate(0)+(0,)))
 
-def extractUimageDate(image): # grab and convert timestamp from header
-	timestamp = endian.long(image[8:12])
-	d = datetime.fromtimestamp(1367899411)
+def extractUimageDate(image): # convert ih_time from the header
+	header = uimageHead(image)
+	d = datetime.datetime.fromtimestamp(header.ih_time if header else 0)
 	return dateString(d.year, d.month, d.day, d.hour, d.minute, d.second)
 
 # utilities
@@ -177,14 +214,14 @@ def versionDate(image):
 		return result
 
 # application version name and date
-def extractNameDateVersion(image, endianness='big'):
+def extractNameDateVersion(segments, endianness='big'): # search each segment of a segmentMap
 	name, date, version = 'naname','2000-01-01 00:00:00',0
 	tag = map(chr, endian.byteList(versionTag,4,endianness))
-	offset = listfind(image, tag)
-	if offset != -1:
-		offset += len(tag)
-		name = endian.l2s(image[offset:][:16])
-		date = MDYHMSasYMDHMS(endian.l2s(image[offset+16:][:20]))
+	address = segments.find(''.join(tag))
+	if address != -1:
+		address += len(tag)
+		name = segments.read(address, 16).tobytes()
+		date = MDYHMSasYMDHMS(segments.read(address+16, 20).tobytes())
 		version = buildVersion(date)
 	name = map(ord, name) + [0]*(APP_NAME_LENGTH - len(name))
 	date = map(ord, date) + [0]*(RELEASE_DATE_LENGTH - len(date))
@@ -194,7 +231,7 @@ def extractNameDateVersion(image, endianness='big'):
 def testAppVD():
 	import image
 	srec = image.imageRecord('Test/testApp.srec')
-	name, date, version = extractNameDateVersion(srec.image, 'little')
+	name, date, version = extractNameDateVersion(srec.segments, 'little')
 	print 'image name: ', name, ' and date: ', date, ' version:', version
 
 if __name__ == '__main__':
@@ -0,0 +1,178 @@
+# firmware bundles: the images for a board and how to send them in one archive
+
+'''
+A bundle is a zip archive of image files and a manifest.json describing each:
+  {"version": 1, "items": [
+    {"name": "Main App L", "file": "app.srec", "kind": "srecord",
+     "target": "0x08040000", "whofor": 1, "header": 1, "endian": "little",
+     "start": "0x08000000", "size": 65600, "entry": "0x08000101",
+     "fletcher32": "0x49FCEC14", "crc32": "0x8C5F3A0B"}, ...]}
+kind is srecord for flash targets, eeprom for an EEPROM script or jam for a
+jam player file. crc32 is of the file and fletcher32 of the image as loaded,
+the checksum shown and sent for it.
+
+Opening a bundle reads only the manifest and the zip directory: each item's
+crc32 must match the one zip keeps for its member so nothing is decompressed
+to check it. Members are extracted once to the cache directory, where zip
+checks their crc32 again, and are loaded from there. Images are checked
+against their fletcher32 before anything is sent.
+
+usage: python bundle.py bundle.zip items.json
+makes a bundle from a manifest without checksums; file paths are relative to
+items.json.
+'''
+from pyqtapi2 import *
+import os, sys, time, json, zipfile, hashlib, shutil
+from message import *
+import image, imagecache
+from checksum import checksumEngine
+
+printme = 0
+MANIFEST = 'manifest.json'
+VERSION = 1
+KINDS = ['srecord', 'eeprom', 'jam']
+
+class bundleError(Exception):
+	pass
+
+def number(x): # manifest numbers may be written in hex
+	return int(x, 0) if isinstance(x, basestring) else int(x)
+
+def fileCrc(file):
+	crc = checksumEngine('crc32')
+	with open(file, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), ''):
+			crc.update(block)
+	return crc.digest()
+
+def makeBundle(file, items, directory=''): # items as in the manifest without checksums
+	manifest = dict(version=VERSION, items=[])
+	archive = zipfile.ZipFile(file, 'w', zipfile.ZIP_DEFLATED)
+	try:
+		for item in items:
+			item = dict(item)
+			item.setdefault('kind', 'srecord')
+			if item['kind'] not in KINDS:
+				raise bundleError('Unknown kind %s for %s'%(item['kind'], item['file']))
+			path = os.path.join(directory, item['file'])
+			record = image.imageRecord(None)
+			record.follow = False
+			record.base = number(item.get('target', 0))
+			record.readFile(path)
+			if not record.segments:
+				raise bundleError('No image in %s'%path)
+			item['file'] = os.path.basename(path)
+			item['start'], item['size'], item['entry'] = hex(record.start), record.size, hex(record.entry)
+			item['fletcher32'] = '0x%08X'%record.checksum
+			item['crc32'] = '0x%08X'%fileCrc(path)
+			archive.write(path, item['file'])
+			manifest['items'].append(item)
+		archive.writestr(MANIFEST, json.dumps(manifest, indent=1, sort_keys=True))
+	finally:
+		archive.close()
+	return manifest
+
+class firmwareBundle(object):
+	def __init__(self, file):
+		self.file = os.path.abspath(file)
+		try:
+			self.archive = zipfile.ZipFile(self.file)
+			manifest = json.loads(self.archive.read(MANIFEST))
+		except (zipfile.BadZipfile, KeyError, ValueError, IOError), e:
+			raise bundleError('Not a firmware bundle %s: %s'%(file, e))
+		if manifest.get('version') != VERSION:
+			raise bundleError('Bundle version %s not %d'%(manifest.get('version'), VERSION))
+		self.items = manifest['items']
+		self.validate()
+
+	def validate(self): # manifest against the zip directory
+		members = dict((info.filename, info) for info in self.archive.infolist())
+		for item in self.items:
+			if item.get('kind', 'srecord') not in KINDS:
+				raise bundleError('Unknown kind %s for %s'%(item['kind'], item['file']))
+			info = members.get(item['file'])
+			if info is None:
+				raise bundleError('%s missing from bundle'%item['file'])
+			if number(item['crc32']) != info.CRC:
+				raise bundleError('%s crc32 %08X is not %08X'%(item['file'], info.CRC, number(item['crc32'])))
+
+	def directory(self): # where members are extracted; changes with the bundle
+		stat = os.stat(self.file)
+		key = hashlib.sha1('%s %s %s'%(self.file, stat.st_mtime, stat.st_size)).hexdigest()
+		return os.path.join(os.path.dirname(imagecache.cacheDir()), 'bundles', key)
+
+	def extract(self): # path of each item's file; members already extracted are kept
+		dir = self.directory()
+		if not os.path.isdir(dir):
+			temp = dir + '.%d'%os.getpid()
+			try:
+				for item in self.items:
+					self.archive.extract(item['file'], temp)
+				os.rename(temp, dir)
+			except (zipfile.BadZipfile, IOError, OSError), e:
+				shutil.rmtree(temp, True)
+				raise bundleError('Bundle %s: %s'%(self.file, e))
+		return [os.path.join(dir, item['file']) for item in self.items]
+
+	def close(self):
+		self.archive.close()
+
+def check(item, record): # True if record holds the image the manifest describes
+	if record.loaders:
+		error('%s is still loading.'%item['file'])
+		return False
+	if record.checksum != number(item['fletcher32']):
+		error('%s checksum %X is not %X'%(item['file'], record.checksum, number(item['fletcher32'])))
+		return False
+	return True
+
+class batchFlash(QObject):
+	'''
+	Run transfers one after another, each started when the one before has
+	finished well; any failure stops the run.
+	'''
+	finished = Signal(object)
+
+	def __init__(self):
+		QObject.__init__(self)
+		self.steps = []
+		self.current = None
+
+	def add(self, name, transfer, start): # start begins the transfer; it ends with transferFinished
+		self.steps.append((name, transfer, start))
+
+	def start(self):
+		self.startTime = time.time()
+		self.next(True)
+
+	def next(self, ok):
+		if self.current:
+			self.current.transferFinished.disconnect()
+			self.current = None
+		if not ok:
+			error('Batch stopped.')
+			del self.steps[:]
+			self.finished.emit(False)
+		elif not self.steps:
+			note('Batch finished in %.1f seconds'%(time.time() - self.startTime))
+			self.finished.emit(True)
+		else:
+			name, transfer, start = self.steps.pop(0)
+			note('Batch: %s'%name)
+			self.current = transfer
+			transfer.transferFinished.connect(self.next)
+			start()
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print __doc__
+		sys.exit(1)
+	items = json.load(open(sys.argv[2]))
+	items = items['items'] if isinstance(items, dict) else items
+	try:
+		manifest = makeBundle(sys.argv[1], items, os.path.dirname(sys.argv[2]))
+	except (bundleError, IOError, OSError), e:
+		error(str(e))
+		sys.exit(1)
+	for item in manifest['items']:
+		note('%-12s %-8s %s %s'%(item.get('name', ''), item['kind'], item['file'], item['fletcher32']))
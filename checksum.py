@@ -1,7 +1,305 @@
 # check sum
+
+'''
+fletcher32 here is the plain sum of bytes and sum of those sums, each kept
+to 16 bits, as the targets compute it. Rather than a step per byte, a block
+of n bytes b[i] with sum S and weighted sum W = sum(i*b[i]) advances the
+sums at once:
+
+	sum1 += S
+	sum2 += n*sum1 + n*S - W
+
+W is taken from row and column sums: with rows of B bytes,
+i = B*row + column, so W is B times the sum of row*rowsum plus the sum of
+column*columnsum. With numpy those are reductions over the block reshaped
+into rows; without it they are sums over slices, which still run in C.
+Those sums make an int of every byte, so the pure python path is only some
+5 times faster than a byte at a time; the 50 times wanted for large images
+needs numpy.
+
+Every checksum used with targets is an engine with the same streaming
+interface: update, fill, copy and digest, which gives an int. Engines are
+made by name from the engines table so the one a target uses can be set
+rather than coded. Data may be any buffer: str, bytearray, buffer, mmap,
+memoryview or a list of ints. Where a C routine can read it in place it
+is handed over as a buffer object rather than copied.
+
+python checksum.py checks the block forms and the engines against a byte
+at a time over random buffers and times them, saying which path fletcher32
+takes here.
+'''
+import zlib, binascii, hashlib
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+BLOCK_SIZE = 1024 * 1024 # bytes summed at once; keeps numpy's weighted sums in 64 bits
+FILL_SIZE = 64 * 1024 # most bytes of fill made at once
+ROW = 1024 # bytes in each row numpy sums
+weights = {} # numpy position weights by block length
+
 def fletcher32(address, length): # fletcher 32 bit
-	sum1 = sum2 = 0
-	for i in range(length):
-		sum1 += address[i]
-		sum2 += sum1
+	return fletcherDigest(fletcherSums(address[:length]))
+
+# running form of fletcher32 so a checksum can be carried across segments and holes
+def fletcherSums(data, sums=(0, 0)): # advance sums over a buffer of bytes
+	sum1, sum2 = sums
+	for start in range(0, len(data), BLOCK_SIZE):
+		block = data[start:start + BLOCK_SIZE]
+		n = len(block)
+		total, weighted = blockSums(block)
+		sum1, sum2 = sum1 + total, sum2 + n*sum1 + n*total - weighted
+	return sum1, sum2
+
+def blockSums(block): # sum of the bytes and of each byte times its position
+	if numpy is not None:
+		return numpySums(block)
+	if not isinstance(block, bytearray):
+		block = bytearray(block) # memoryview items are not ints in python 2
+	n = len(block)
+	row = 16
+	while row*row < n:
+		row *= 2
+	rows = [sum(block[i:i + row]) for i in range(0, n, row)]
+	weighted = row*sum(r*s for r, s in enumerate(rows))
+	weighted += sum(c*sum(block[c::row]) for c in range(1, min(row, n)))
+	return sum(rows), weighted
+
+def numpySums(block): # as blockSums with the rows and columns summed by numpy
+	try:
+		values = numpy.frombuffer(block, dtype=numpy.uint8)
+	except (TypeError, AttributeError, ValueError): # a list of ints or no buffer interface
+		values = numpy.frombuffer(bytearray(block), dtype=numpy.uint8)
+	n = len(values)
+	full = n - n % ROW
+	table = values[:full].reshape(-1, ROW)
+	rows = table.sum(axis=1, dtype=numpy.int64)
+	columns = table.sum(axis=0, dtype=numpy.int64)
+	tail = values[full:].astype(numpy.int64)
+	weighted = ROW*int(numpy.dot(positions(len(rows)), rows)) + int(numpy.dot(positions(ROW), columns))
+	weighted += int(numpy.dot(positions(len(tail)) + full, tail))
+	return int(rows.sum()) + int(tail.sum()), weighted
+
+def positions(n): # 0 to n-1 as numpy int64s; kept for the lengths used
+	if n not in weights:
+		if len(weights) > 8:
+			weights.clear()
+		weights[n] = numpy.arange(n, dtype=numpy.int64)
+	return weights[n]
+
+def fletcherFill(value, count, sums=(0, 0)): # advance sums over count bytes of value
+	sum1, sum2 = sums
+	return sum1 + value*count, sum2 + sum1*count + value*count*(count + 1)//2
+
+def fletcherDigest(sums):
+	sum1, sum2 = sums
 	return ((sum2 & 0xFFFF) << 16)|(sum1 & 0xFFFF)
+
+def readable(data): # data as something zlib, binascii and hashlib read in place
+	if isinstance(data, (str, buffer)):
+		return data
+	if isinstance(data, list):
+		data = bytearray(data)
+	try:
+		return buffer(data)
+	except TypeError: # python 2 memoryviews have no old style buffer
+		return data.tobytes()
+
+class checksumStream(object):
+	size = 4 # bytes in the digest
+
+	def fill(self, value, count): # count bytes of value, as for a hole
+		page = chr(value) * min(count, FILL_SIZE)
+		while count:
+			n = min(count, len(page))
+			self.update(buffer(page, 0, n))
+			count -= n
+		return self
+
+class fletcherStream(checksumStream):
+	'''
+	fletcher32 fed a piece at a time. copy keeps the state at a point, and
+	since gives the checksum of what was fed after such a copy without going
+	over any of it again.
+	'''
+	def __init__(self, sums=(0, 0), count=0):
+		self.sums = sums
+		self.count = count # bytes fed
+
+	def update(self, data):
+		self.sums = fletcherSums(data, self.sums)
+		self.count += len(data)
+		return self
+
+	def fill(self, value, count):
+		self.sums = fletcherFill(value, count, self.sums)
+		self.count += count
+		return self
+
+	def copy(self):
+		return fletcherStream(self.sums, self.count)
+
+	def digest(self):
+		return fletcherDigest(self.sums)
+
+	def since(self, earlier): # checksum of the bytes fed after earlier, a copy of this stream
+		n = self.count - earlier.count
+		sum1 = self.sums[0] - earlier.sums[0]
+		sum2 = self.sums[1] - earlier.sums[1] - n*earlier.sums[0]
+		return fletcherDigest((sum1, sum2))
+
+class crc32Stream(checksumStream): # zlib crc32, as in zip files and uImages
+	def __init__(self, crc=0):
+		self.crc = crc
+
+	def update(self, data):
+		self.crc = zlib.crc32(readable(data), self.crc)
+		return self
+
+	def copy(self):
+		return crc32Stream(self.crc)
+
+	def digest(self):
+		return self.crc & 0xFFFFFFFF
+
+class crc16Stream(checksumStream): # crc16 ccitt: polynomial 0x1021 starting from 0xFFFF
+	size = 2
+
+	def __init__(self, crc=0xFFFF):
+		self.crc = crc
+
+	def update(self, data):
+		self.crc = binascii.crc_hqx(readable(data), self.crc)
+		return self
+
+	def copy(self):
+		return crc16Stream(self.crc)
+
+	def digest(self):
+		return self.crc
+
+class xor8Stream(checksumStream): # every byte exclusive ored, as the STM32 boot loader checks
+	size = 1
+
+	def __init__(self, value=0):
+		self.value = value
+
+	def update(self, data):
+		data = readable(data)
+		if len(data):
+			value = int(binascii.hexlify(data), 16)
+			width = 8
+			while width < 8*len(data):
+				width *= 2
+			while width > 8: # fold halves together until a byte is left
+				width //= 2
+				value = (value >> width) ^ (value & ((1 << width) - 1))
+			self.value ^= value
+		return self
+
+	def copy(self):
+		return xor8Stream(self.value)
+
+	def digest(self):
+		return self.value
+
+class sha256Stream(checksumStream):
+	size = 32
+
+	def __init__(self, hash=None):
+		self.hash = hash or hashlib.sha256()
+
+	def update(self, data):
+		self.hash.update(readable(data))
+		return self
+
+	def copy(self):
+		return sha256Stream(self.hash.copy())
+
+	def digest(self):
+		return int(self.hash.hexdigest(), 16)
+
+engines = {'fletcher32': fletcherStream, 'crc32': crc32Stream, 'crc16-ccitt': crc16Stream,
+		   'xor8': xor8Stream, 'sha256': sha256Stream}
+
+def checksumEngine(name): # new stream of the named checksum
+	if name not in engines:
+		raise ValueError('Unknown checksum %s; one of %s'%(name, ', '.join(sorted(engines))))
+	return engines[name]()
+
+def checksumOf(name, data):
+	return checksumEngine(name).update(data).digest()
+
+if __name__ == '__main__':
+	import os, random, time
+
+	def byteAtATime(address, length): # the original loop the block forms must match
+		sum1 = sum2 = 0
+		for i in range(length):
+			sum1 += address[i]
+			sum2 += sum1
+		return ((sum2 & 0xFFFF) << 16)|(sum1 & 0xFFFF)
+
+	def check(engine):
+		random.seed(1)
+		lengths = list(range(0, 70)) + [255, 256, 257, 1023, 4097, 65535, 65537, 300001]
+		lengths += [random.randrange(1, 200000) for i in range(20)]
+		for length in lengths:
+			data = bytearray(os.urandom(length))
+			expected = byteAtATime(data, length)
+			cut = random.randrange(length + 1)
+			stream = fletcherStream().update(data[:cut])
+			checkpoint = stream.copy()
+			stream.update(data[cut:])
+			results = [fletcher32(data, length), fletcher32(list(data), length),
+					   fletcher32(data + bytearray(5), length), fletcher32(memoryview(data), length),
+					   fletcherDigest(fletcherSums(data[cut:], fletcherSums(data[:cut]))),
+					   stream.digest()]
+			if any(result != expected for result in results) or \
+			   stream.since(checkpoint) != byteAtATime(data[cut:], length - cut):
+				print('%s: mismatch at length %d: %08X %s'%(engine, length, expected, results))
+				return False
+		data = bytearray([0xFF])*12345
+		if fletcherDigest(fletcherFill(0xFF, 12345)) != byteAtATime(data, len(data)):
+			print('%s: fill mismatch'%engine)
+			return False
+		for name in sorted(engines):
+			data = bytearray(os.urandom(100001))
+			whole = checksumOf(name, str(data))
+			stream = checksumEngine(name).update(memoryview(data)[:5000])
+			split = stream.copy().update(list(data[5000:])).digest()
+			filled = checksumEngine(name).update(data[:7]).fill(0x5A, 70000).digest()
+			if split != whole or filled != checksumOf(name, data[:7] + bytearray([0x5A])*70000):
+				print('%s: %s stream mismatch'%(engine, name))
+				return False
+		reference = {'fletcher32': byteAtATime(bytearray('123456789'), 9), 'crc32': 0xCBF43926,
+					 'crc16-ccitt': 0x29B1, 'xor8': 0x31, 'sha256': int(hashlib.sha256('123456789').hexdigest(), 16)}
+		for name in sorted(engines):
+			if checksumOf(name, '123456789') != reference[name]:
+				print('%s: %s check value mismatch'%(engine, name))
+				return False
+		print('%s: %d lengths match'%(engine, len(lengths)))
+		return True
+
+	def bench(engine, data): # best of a few runs
+		times = []
+		for i in range(5):
+			t = time.time()
+			fletcher32(data, len(data))
+			times.append(time.time() - t)
+		return min(times)
+
+	data = bytearray(os.urandom(2 * 1024 * 1024))
+	t = time.time()
+	byteAtATime(data, len(data))
+	t = time.time() - t
+	ok = True
+	print('fletcher32 path: %s'%('numpy' if numpy is not None else 'python; numpy is not installed, so no 50x'))
+	for engine in (['numpy'] if numpy is not None else []) + ['python']:
+		if engine == 'python':
+			numpy = None
+		ok = check(engine) and ok
+		took = bench(engine, data)
+		print('%s: 2MB in %.4f seconds, %.0fx a byte at a time'%(engine, took, t / max(took, 1e-6)))
+	raise SystemExit(0 if ok else 1)
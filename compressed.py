@@ -0,0 +1,115 @@
+# read gzip, bz2 and xz or lzma compressed images without decompressing to disk
+
+'''
+Compressed files are recognised by their suffix, .gz, .bz2, .xz or .lzma,
+and the magic number at their start must agree; other files are read as they
+are whatever bytes they begin with, as a raw binary may begin with anything.
+lzma alone files have no magic number worth the name and go by suffix only.
+They are decompressed a block at a time as they are read so the parsers see
+lines just as they would from the plain file. Data the decoder rejects is
+an IOError. Concatenated streams,
+as made by appending to a .gz file, are read one after the other. tell and
+fileno are those of the compressed file so load progress is still a fraction
+of what is on disk.
+
+xz and lzma need the lzma module: part of python 3 and available for python 2
+as backports.lzma. Without it those files are reported and not read.
+'''
+import zlib, bz2
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma = None
+
+BLOCK_SIZE = 64 * 1024 # compressed bytes read at a time
+SUFFIXES = {'gz': 'gzip', 'bz2': 'bz2', 'xz': 'xz', 'lzma': 'lzma'} # dropped to find the format inside
+MAGIC = {'gzip': '\x1f\x8b', 'bz2': 'BZh', 'xz': '\xfd7zXZ\x00'}
+
+def compression(file): # 'gzip', 'bz2', 'xz', 'lzma' or None for a plain file
+	kind = SUFFIXES.get(file.rpartition('.')[2])
+	if kind in MAGIC:
+		with open(file, 'rb') as f:
+			if f.read(len(MAGIC[kind])) != MAGIC[kind]: # misnamed; read it as it is
+				return None
+	return kind
+
+def plainName(name): # name with any compression suffix dropped: app.hex.gz -> app.hex
+	stem, dot, ext = name.rpartition('.')
+	if dot and ext in SUFFIXES:
+		return stem
+	return name
+
+def decompressor(kind):
+	if kind == 'gzip':
+		return zlib.decompressobj(16 + zlib.MAX_WBITS) # expect a gzip header and trailer
+	if kind == 'bz2':
+		return bz2.BZ2Decompressor()
+	if lzma is None:
+		raise IOError('No lzma module to decompress %s files'%kind)
+	return lzma.LZMADecompressor()
+
+def openFile(file, mode='r'): # file or, if it is compressed, a decompressedFile of it
+	kind = compression(file)
+	if kind is None:
+		return open(file, mode)
+	return decompressedFile(file, kind)
+
+class decompressedFile(object):
+	'''
+	Read only stream of a compressed file; either iterated over for lines or
+	read once.
+	'''
+	def __init__(self, file, kind):
+		decompressor(kind) # fail now if it cannot be read
+		self.name = file
+		self.kind = kind
+		self.raw = open(file, 'rb')
+
+	def blocks(self): # decompressed data as it comes
+		stream = decompressor(self.kind)
+		for block in iter(lambda: self.raw.read(BLOCK_SIZE), ''):
+			while block:
+				try:
+					data = stream.decompress(block)
+				except EOFError: # bz2 and lzma stop at the end of a stream
+					stream = decompressor(self.kind)
+					continue
+				except (IOError, zlib.error, getattr(lzma, 'LZMAError', IOError)), e:
+					raise IOError('Bad %s data in %s: %s'%(self.kind, self.name, e))
+				block = stream.unused_data # another stream follows
+				if block:
+					stream = decompressor(self.kind)
+				if data:
+					yield data
+
+	def __iter__(self):
+		rest = ''
+		for data in self.blocks():
+			lines = (rest + data).split('\n')
+			rest = lines.pop()
+			for line in lines:
+				yield line + '\n'
+		if rest:
+			yield rest
+
+	def read(self, size=-1): # at most size bytes, or all of it
+		data, length = [], 0
+		for block in self.blocks():
+			data.append(block)
+			length += len(block)
+			if 0 <= size <= length:
+				break
+		data = ''.join(data)
+		return data[:size] if size >= 0 else data
+
+	def tell(self):
+		return self.raw.tell()
+
+	def fileno(self):
+		return self.raw.fileno()
+
+	def close(self):
+		self.raw.close()
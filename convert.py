@@ -0,0 +1,52 @@
+# convert images between ELF, binary, Intel hex and S-record files
+
+'''
+usage: python convert.py source destination [base=0x08000000] [length=32] [format=srec]
+The formats are taken from the suffixes: .elf, .bin, .hex, .srec or .S19 in,
+optionally compressed as .gz, .bz2, .xz, and .bin, .hex, .srec or .S19 out. base is the load address of a binary
+without a sidecar and length the data bytes per record. If source is a
+directory every image in it is converted into the destination directory in
+the given format.
+'''
+import sys, os, time
+import image, compressed
+from message import *
+
+FORMATS = ['elf', 'bin', 'hex', 'srec', 'S19'] # readable by imageRecord
+
+def convert(source, destination, base=0, length=None):
+	record = image.imageRecord(None)
+	record.follow = False
+	record.base = base
+	record.readFile(source)
+	if not record.segments:
+		error('No image in %s'%source)
+		return False
+	record.writeImage(destination, length)
+	return True
+
+def convertDirectory(source, destination, format, base=0, length=None):
+	if not os.path.isdir(destination):
+		os.makedirs(destination)
+	count = 0
+	for name in sorted(os.listdir(source)):
+		stem, ext = os.path.splitext(compressed.plainName(name))
+		if ext[1:] in FORMATS and os.path.isfile(os.path.join(source, name)):
+			if convert(os.path.join(source, name), os.path.join(destination, stem + '.' + format), base, length):
+				count += 1
+	return count
+
+if __name__ == '__main__':
+	args = [a for a in sys.argv[1:] if '=' not in a]
+	options = dict(a.split('=', 1) for a in sys.argv[1:] if '=' in a)
+	if len(args) != 2:
+		print __doc__
+		sys.exit(1)
+	base = int(options.get('base', '0'), 0)
+	length = int(options['length'], 0) if 'length' in options else None
+	t = time.time()
+	if os.path.isdir(args[0]):
+		count = convertDirectory(args[0], args[1], options.get('format', 'srec'), base, length)
+		note('converted %d files in %.1f seconds'%(count, time.time() - t))
+	elif not convert(args[0], args[1], base, length):
+		sys.exit(1)
@@ -5,7 +5,7 @@ from imageTransfer import imageTransfer
 from transfer import *
 from protocols import pids
 from message import *
-import binascii
+from checksum import checksumOf
 
 class eepromTransfer(imageTransfer):
 	endToken = "END;"
@@ -18,7 +18,7 @@ class eepromTransfer(imageTransfer):
 		self.transferType = TEXT_TRANSFER
 
 	def checkScriptCrc(self):
-		image = ''.join(map(chr, self.image))
+		image = str(self.image)
 		if image.find(self.endToken) == -1:
 			warning('Could not find ' + self.endToken + ' within script')
 			self.scriptOk.emit(False)
@@ -26,7 +26,7 @@ class eepromTransfer(imageTransfer):
 			endp = image.find(self.endToken);
 			endp += len(self.endToken)
 			self.scriptCrc = 0
-			calcCrc = binascii.crc32(image[:endp]) & 0xFFFFFFFF
+			calcCrc = checksumOf('crc32', buffer(image, 0, endp))
 			if len(image[endp:]) >= 8:
 				self.scriptCrc = int(image[endp:endp+8], 16)
 				if calcCrc == self.scriptCrc:
@@ -0,0 +1,159 @@
+# ELF executable reader over a memory mapped file
+
+'''
+The file is mapped rather than read so headers are unpacked in place with
+struct and segment data is handed out as views of the mapping. The only copy
+is the one into the image buffer. The mapping stays open while any view of it
+is alive and is released once they are gone. A compressed file is
+decompressed into memory instead since headers are read out of order.
+'''
+import mmap, struct
+import compressed
+from collections import namedtuple
+
+# named constants
+EI_MAG0, EI_MAG1, EI_MAG2, EI_MAG3, EI_CLASS, EI_DATA, EI_VERSION, EI_PAD, EI_NIDENT = range(8) + [16]
+ELFMAG = '\x7fELF'
+ELFCLASSNONE, ELFCLASS32, ELFCLASS64 = range(3)
+ELFDATANONE, ELFDATA2LSB, ELFDATA2MSB = range(3)
+ET_NONE, ET_REL, ET_EXEC, ET_DYN, ET_CORE = range(5)
+EM_NONE, EM_M32, EM_SPARC, EM_386, EM_68K, EM_88K, EM_86O, EM_MIPS, EM_ARM = range(6) + [7,8,0x28]
+PT_NULL, PT_LOAD, PT_DYNAMIC, PT_INTERP, PT_NOTE, PT_SHLIB, PT_PHDR, PT_TLS = range(8)
+SHT_NULL, SHT_PROGBITS, SHT_SYMTAB, SHT_STRTAB, SHT_RELA, SHT_HASH, SHT_DYNAMIC, SHT_NOTE = range(8)
+SHT_DYNSYM = 11
+STT_NOTYPE, STT_OBJECT, STT_FUNC, STT_SECTION, STT_FILE = range(5)
+NT_GNU_BUILD_ID = 3
+
+# header layouts by class as (format, field order); the endian prefix is added once the file is opened
+elfHeader = namedtuple('elfHeader', 'ident type machine version entry phoff shoff flags '
+					   'ehsize phentsize phnum shentsize shnum shstrndx')
+programHeader = namedtuple('programHeader', 'p_type p_offset p_vaddr p_paddr p_filesz p_memsz p_flags p_align')
+sectionHeader = namedtuple('sectionHeader', 'sh_name sh_type sh_flags sh_addr sh_offset sh_size '
+						   'sh_link sh_info sh_addralign sh_entsize')
+symbol = namedtuple('symbol', 'st_name st_value st_size st_info st_other st_shndx')
+
+LAYOUTS = {
+	ELFCLASS32: {
+		elfHeader: ('16sHHLLLLLHHHHHH', elfHeader._fields),
+		programHeader: ('LLLLLLLL', programHeader._fields),
+		sectionHeader: ('LLLLLLLLLL', sectionHeader._fields),
+		symbol: ('LLLBBH', symbol._fields)},
+	ELFCLASS64: { # wider addresses and offsets; flags move up in program headers to keep alignment
+		elfHeader: ('16sHHLQQQLHHHHHH', elfHeader._fields),
+		programHeader: ('LLQQQQQQ', 'p_type p_flags p_offset p_vaddr p_paddr p_filesz p_memsz p_align'.split()),
+		sectionHeader: ('LLQQQQLLQQ', sectionHeader._fields),
+		symbol: ('LBBHQQ', 'st_name st_info st_other st_shndx st_value st_size'.split())}}
+
+class elfError(Exception):
+	pass
+
+class elfFile(object):
+	def __init__(self, file):
+		if compressed.compression(file):
+			self.map = compressed.openFile(file).read()
+		else:
+			with open(file, 'rb') as f:
+				try:
+					self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				except ValueError: # empty files cannot be mapped
+					raise elfError('Not an elf file')
+		if self.map[:len(ELFMAG)] != ELFMAG:
+			raise elfError('Not an elf file')
+		if ord(self.map[EI_CLASS]) not in LAYOUTS:
+			raise elfError('Unknown elf class')
+		self.endian = '>' if ord(self.map[EI_DATA]) == ELFDATA2MSB else '<'
+		self.layouts = dict((kind, (struct.Struct(self.endian + format), order))
+							for kind, (format, order) in LAYOUTS[ord(self.map[EI_CLASS])].items())
+		header = self.read(elfHeader, 0)
+		self.header = header._replace(ident=bytearray(header.ident))
+
+	def __getattr__(self, name): # header fields read as attributes: elf.entry, elf.phnum...
+		if name in elfHeader._fields:
+			return getattr(self.header, name)
+		raise AttributeError(name)
+
+	def unpack(self, format, offset):
+		try:
+			return struct.unpack_from(self.endian + format, self.map, offset)
+		except struct.error:
+			raise elfError('Truncated elf file')
+
+	def read(self, kind, offset): # header of kind at offset laid out for this file's class
+		layout, order = self.layouts[kind]
+		try:
+			return kind(**dict(zip(order, layout.unpack_from(self.map, offset))))
+		except struct.error:
+			raise elfError('Truncated elf file')
+
+	def programHeaders(self):
+		return [self.read(programHeader, self.header.phoff + i * self.header.phentsize)
+				for i in range(self.header.phnum)]
+
+	def sectionHeaders(self):
+		return [self.read(sectionHeader, self.header.shoff + i * self.header.shentsize)
+				for i in range(self.header.shnum)]
+
+	def string(self, table, offset): # name at offset in a string table section
+		start = table.sh_offset + offset
+		end = self.map.find('\0', start, table.sh_offset + table.sh_size)
+		return self.map[start:end if end != -1 else table.sh_offset + table.sh_size]
+
+	def symbols(self): # (name, symbol) from the symbol table, or the dynamic one if stripped
+		sections = self.sectionHeaders()
+		tables = [sh for sh in sections if sh.sh_type == SHT_SYMTAB] or \
+				 [sh for sh in sections if sh.sh_type == SHT_DYNSYM]
+		for table in tables[:1]:
+			if table.sh_link >= len(sections) or table.sh_offset + table.sh_size > len(self.map):
+				raise elfError('Bad symbol table')
+			names = sections[table.sh_link]
+			for offset in range(table.sh_offset, table.sh_offset + table.sh_size,
+								table.sh_entsize or self.layouts[symbol][0].size):
+				sym = self.read(symbol, offset)
+				yield self.string(names, sym.st_name), sym
+
+	def buildId(self): # hex of the GNU build id note or None
+		for sh in self.sectionHeaders():
+			if sh.sh_type != SHT_NOTE:
+				continue
+			offset, end = sh.sh_offset, sh.sh_offset + sh.sh_size
+			while offset + 12 <= end:
+				namesz, descsz, type = self.unpack('LLL', offset)
+				name = offset + 12
+				desc = name + (namesz + 3 & ~3)
+				if type == NT_GNU_BUILD_ID and self.map[name:name + namesz] == 'GNU\0':
+					return self.map[desc:desc + descsz].encode('hex')
+				offset = desc + (descsz + 3 & ~3)
+		return None
+
+	def data(self, offset, size): # zero copy view of file contents
+		if offset + size > len(self.map):
+			raise elfError('Segment outside of file')
+		try:
+			return memoryview(self.map)[offset:offset + size]
+		except TypeError: # python 2 mmap has only the old buffer interface
+			return buffer(self.map, offset, size)
+
+	def loads(self):
+		'''
+		[address, offset, size] of the file contents of the loadable segments
+		in address order. Other program headers, like notes or relro, only
+		describe parts of these and are left out. Segments that follow on from
+		each other in both memory and the file are merged. The zero filled
+		tail of a segment, where p_memsz exceeds p_filesz, is not included.
+		'''
+		loads = []
+		for ph in sorted(self.programHeaders(), key=lambda ph: ph.p_paddr):
+			if ph.p_type != PT_LOAD or not ph.p_filesz:
+				continue
+			if loads and loads[-1][0] + loads[-1][2] == ph.p_paddr and loads[-1][1] + loads[-1][2] == ph.p_offset:
+				loads[-1][2] += ph.p_filesz
+			else:
+				loads.append([ph.p_paddr, ph.p_offset, ph.p_filesz])
+		return loads
+
+	def segments(self): # (address, data) of each loadable segment
+		return [(address, self.data(offset, size)) for address, offset, size in self.loads()]
+
+	def close(self): # only once no views are in use
+		if isinstance(self.map, mmap.mmap):
+			self.map.close()
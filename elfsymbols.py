@@ -0,0 +1,133 @@
+# look up the function holding an address from an elf file's symbol table
+
+'''
+Crash dumps and program counters come back from targets as hex. The symbol
+table of the elf file that was flashed is sorted by address once, when first
+needed, so an address is found by bisection. Indexes are kept by the file's
+GNU build id, or its path, mtime and size if it has none, so a rebuilt file
+is read again but a touched one is not. A file is looked at on disk at most
+once every STAT_INTERVAL seconds, or when the images in use change.
+
+The terminal runs incoming text through a symbolFilter, which follows every
+8 digit hex address inside a symbol with <function+offset>. An address split
+between two reads is held back until the rest arrives.
+'''
+import os, re, bisect, time
+from elffile import *
+import compressed
+
+printme = 0
+SEARCH_BACK = 8 # symbols to look back through for one an address falls inside
+STAT_INTERVAL = 2.0 # seconds between looks at an elf file's mtime
+
+class symbolIndex(object):
+	def __init__(self, elf):
+		thumb = elf.machine == EM_ARM # function addresses have bit 0 set for thumb code
+		found = {}
+		for name, sym in elf.symbols():
+			kind = sym.st_info & 0xF
+			if not name or not sym.st_value or kind not in (STT_FUNC, STT_OBJECT):
+				continue
+			address = sym.st_value & ~1 if thumb and kind == STT_FUNC else sym.st_value
+			if address not in found or (kind == STT_FUNC and found[address][1] < sym.st_size):
+				found[address] = (name, sym.st_size)
+		self.addresses = sorted(found)
+		self.names = [found[a][0] for a in self.addresses]
+		self.sizes = [found[a][1] for a in self.addresses]
+		self.low = self.addresses[0] if self.addresses else 0
+		self.high = max([a + n for a, n in zip(self.addresses, self.sizes)] or [0])
+
+	def __len__(self):
+		return len(self.addresses)
+
+	def lookup(self, address): # (name, offset) of the symbol holding address or None
+		if not self.low <= address < self.high:
+			return None
+		i = bisect.bisect_right(self.addresses, address) - 1
+		for j in range(i, max(-1, i - SEARCH_BACK), -1):
+			offset = address - self.addresses[j]
+			if offset < self.sizes[j] or offset == 0:
+				return self.names[j], offset
+		return None
+
+indexes = {} # build id or (path, mtime, size): symbolIndex or None
+stamps = {} # path: ((mtime, size), key)
+checked = {} # path: time its stamp was last taken
+
+def symbolsOf(file): # symbolIndex of an elf file or None; built when first asked for
+	now = time.time()
+	known = stamps.get(file)
+	if known and now - checked.get(file, 0) < STAT_INTERVAL:
+		return indexes.get(known[1])
+	checked[file] = now
+	try:
+		stat = os.stat(file)
+	except OSError:
+		return None
+	stamp = (stat.st_mtime, stat.st_size)
+	if known and known[0] == stamp:
+		return indexes.get(known[1])
+	key = None
+	try:
+		elf = elfFile(file)
+		key = elf.buildId() or (os.path.abspath(file),) + stamp
+		if key not in indexes:
+			index = symbolIndex(elf)
+			indexes[key] = index if len(index) else None
+			if printme: print 'symbols from %s: %d'%(file, len(index))
+	except elfError, e:
+		if printme: print 'no symbols from %s: %s'%(file, e)
+	stamps[file] = (stamp, key)
+	return indexes.get(key)
+
+def elfFor(file): # the elf file an image was built from: itself or one beside it
+	if not file:
+		return None
+	stem, ext = os.path.splitext(compressed.plainName(file))
+	if ext == '.elf':
+		return file
+	if os.path.exists(stem + '.elf'):
+		return stem + '.elf'
+	return None
+
+class symbolFilter(object):
+	ADDRESS = re.compile(r'\b0[xX]([0-9a-fA-F]{8})\b')
+	PARTIAL = re.compile(r'\b0(?:[xX][0-9a-fA-F]{0,8})?\Z') # may be continued by the next read
+
+	def __init__(self):
+		self.files = [] # elf files to look addresses up in
+		self.held = ''
+
+	def use(self, files): # images being used; their elf files give the symbols
+		self.files = [elf for elf in map(elfFor, files) if elf]
+		checked.clear() # an image was loaded; look at the files again
+
+	def annotate(self, text):
+		if self.held:
+			text, self.held = self.held + text, ''
+		if not self.files or '0' not in text:
+			return text
+		partial = self.PARTIAL.search(text)
+		if partial:
+			text, self.held = text[:partial.start()], text[partial.start():]
+		return self.symbolize(text)
+
+	def symbolize(self, text): # every whole address in text followed by its symbol
+		if 'x' not in text and 'X' not in text:
+			return text
+		indexes = [index for index in map(symbolsOf, self.files) if index]
+		if not indexes:
+			return text
+		def replace(match):
+			address = int(match.group(1), 16)
+			for index in indexes:
+				found = index.lookup(address)
+				if found:
+					name, offset = found
+					return '%s <%s+0x%x>'%(match.group(0), name, offset) if offset else '%s <%s>'%(match.group(0), name)
+			return match.group(0)
+		return self.ADDRESS.sub(replace, text)
+
+	def flush(self): # text held back waiting for the rest of an address; no more is coming
+		text, self.held = self.held, ''
+		return self.symbolize(text) if text and self.files else text
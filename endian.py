@@ -1,7 +1,47 @@
 # endian mixup prevention  Rob Chapman  Jan 27, 2011
 # big endian format is default
 
+# Every packet sent or received goes through here so formats are compiled to
+# struct.Struct once per (format, endian) and kept. unpackFrom and packInto
+# work on buffers in place; cast and the integer functions below use them
+# for buffers and keep to lists of bytes for callers that build packets as
+# lists. python endian.py checks them against the old arithmetic and times
+# both.
+
+import struct
+import sys
+
 printme = 0
+PREFIX = {'big':'>', 'little':'<'}
+CODECS = 256 # compiled formats kept
+
+codecs = {} # (format, endian): struct.Struct
+sizes = {1:'B', 2:'H', 4:'L', 8:'Q'} # integer format by length
+shifts = {} # (length, endian): shift of each byte in list order
+
+def codec(format, endian="big"): # compiled struct for format in endian byte order
+	try:
+		return codecs[format, endian]
+	except KeyError:
+		if len(codecs) >= CODECS:
+			codecs.clear()
+		compiled = codecs[format, endian] = struct.Struct(PREFIX.get(endian, '<') + format)
+		return compiled
+
+def unpackFrom(format, data, offset=0, endian="big"): # values from any buffer without copying it
+	return codec(format, endian).unpack_from(data, offset)
+
+def packInto(format, data, offset, values, endian="big"): # values into a writable buffer at offset
+	codec(format, endian).pack_into(data, offset, *values)
+
+def pack(format, values, endian="big"):
+	return codec(format, endian).pack(*values)
+
+def byteShifts(length, endian):
+	if (length, endian) not in shifts:
+		order = [8*(length - 1 - i) for i in range(length)]
+		shifts[length, endian] = order if endian == "big" else order[::-1]
+	return shifts[length, endian]
 
 # string of hex to list of hex, must start with 0x
 def hexList (string, endian='big'):
@@ -14,12 +54,7 @@ def hexList (string, endian='big'):
 # numbers to lists of bytes
 def byteList (integer, length, endian="big"): # turn an integer into a list of values
 	if printme: print 'endian:',endian
-	n = length - 1
-	l = [(integer/(2**((n-i)*8)) & 0xFF) for i in range(length)]
-	if endian == "big":
-		return l
-	else:
-		return l[::-1]
+	return [(integer >> shift) & 0xFF for shift in byteShifts(length, endian)]
 
 def shortList (integer, endian="big"): # turn a 2 byte integer into a list of values
 	return byteList(integer, 2, endian)
@@ -32,6 +67,13 @@ def longlongList (integer, endian="big"): # turn a 8 byte integer into a list of
 
 # lists of bytes back to numbers
 def toInteger(bytes, length, endian="big"):
+	if isinstance(bytes, type([])): # shifting in is quicker than converting a short list
+		value = 0
+		for byte in (bytes[:length] if endian == "big" else bytes[length - 1::-1]):
+			value = value << 8 | byte
+		return value
+	if length in sizes: # buffers are read in place
+		return codec(sizes[length], endian).unpack_from(bytes)[0]
 	n = length - 1
 	if endian == "big":
 		return sum((bytes[i]<<(8*(n-i))) for i in range(length))
@@ -107,17 +149,54 @@ TypeError, then the __int__() method is tried. However, the use of
 __int__() is deprecated, and will raise DeprecationWarning.
 '''
 
-import struct
-import sys
 def cast(format, list, endian="big"):
-	if endian == "big":
-		format = '>'+format
-	else:
-		format = '<'+format
+	compiled = codec(format, endian)
 	listsize = len(list)
-	fmtsize = struct.calcsize(format)
+	fmtsize = compiled.size
 	if fmtsize > listsize:
 		print >>sys.stderr, 'error: structure bigger than list: str=%i list=%i'%(fmtsize, listsize)
 		return [0 for i in range(fmtsize)]
-	return struct.unpack(format, l2s(list[0:fmtsize]))
-	
\ No newline at end of file
+	if isinstance(list, type([])):
+		list = bytearray(list[:fmtsize])
+	return compiled.unpack_from(list)
+
+if __name__ == '__main__': # compare with the arithmetic they replaced and time them
+	import timeit
+
+	def oldByteList(integer, length, endian="big"):
+		n = length - 1
+		l = [(integer/(2**((n-i)*8)) & 0xFF) for i in range(length)]
+		return l if endian == "big" else l[::-1]
+
+	def oldCast(format, list, endian="big"):
+		format = ('>' if endian == "big" else '<') + format
+		fmtsize = struct.calcsize(format)
+		return struct.unpack(format, l2s(list[0:fmtsize]))
+
+	packet = [1, 2, 0x12, 0x34, 0x56, 0x78, 0, 0, 0, 0, 0xAB, 0xCD, 0xEF, 0x01]
+	for endian in ['big', 'little']:
+		for value in [0, 1, 0x1234, 0xDEADBEEF, -1, 1 << 40]:
+			for length in [1, 2, 3, 4, 8]:
+				assert byteList(value, length, endian) == oldByteList(value, length, endian)
+				assert toInteger(byteList(value, length, endian), length, endian) == value & ((1 << 8*length) - 1)
+		for format in ['BBLLL', 'BBLBB', 'BBHB4s', '14s']:
+			assert cast(format, packet, endian) == oldCast(format, packet, endian)
+			assert cast(format, ''.join(map(chr, packet)), endian) == oldCast(format, packet, endian)
+			assert cast(format, bytearray(packet), endian) == oldCast(format, packet, endian)
+
+	def oldToInteger(bytes, length, endian="big"):
+		n = length - 1
+		if endian == "big":
+			return sum((bytes[i]<<(8*(n-i))) for i in range(length))
+		return sum((bytes[i]<<(8*(i))) for i in range(length))
+
+	received = bytearray(packet)
+	n = 100000
+	for name, old, new in [
+		('cast BBLLL', lambda: oldCast('BBLLL', packet), lambda: cast('BBLLL', packet)),
+		('unpackFrom', lambda: oldCast('BBLLL', packet), lambda: unpackFrom('BBLLL', received)),
+		('longList', lambda: oldByteList(0x08001234, 4), lambda: longList(0x08001234)),
+		('long', lambda: oldToInteger(packet, 4), lambda: long(packet)),
+		('long buffer', lambda: oldToInteger(received, 4), lambda: long(received))]:
+		before, after = timeit.timeit(old, number=n), timeit.timeit(new, number=n)
+		print '%-12s %.2fus -> %.2fus  %.1fx'%(name, 1e6*before/n, 1e6*after/n, before/after)
@@ -0,0 +1,183 @@
+# watch loaded image files and parse them again when they change on disk
+
+'''
+A build usually rewrites the image while the program is open. Rather than
+finding that out when Send is pressed, files are watched from a thread: with
+inotify on linux and by polling mtime and size elsewhere. A changed file is
+parsed in that thread, which leaves the new image in the image cache, and
+then each receiver watching it has its fileChanged signal emitted with the
+file name. Receivers reload on their own thread and are served from the cache.
+
+Directories are watched rather than files so a build that replaces a file by
+renaming a new one over it is still seen.
+'''
+from pyqtapi2 import *
+import os, sys, time, struct, select, threading, traceback, atexit
+import ctypes, ctypes.util
+import image, compressed
+
+printme = 0
+POLL_INTERVAL = 1.0 # seconds between checks when polling
+SETTLE_TIME = 0.2 # give a build time to finish writing
+REPARSE = ['srec', 'S19', 'hex', 'elf'] # formats worth parsing ahead into the image cache
+
+# inotify
+IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE = 0x8, 0x80, 0x100
+IN_NONBLOCK, IN_CLOEXEC = 0x800, 0x80000
+EVENT = struct.Struct('iIII') # wd, mask, cookie, len; followed by name
+
+def inotify(): # libc with inotify or None
+	if not sys.platform.startswith('linux'):
+		return None
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		libc.inotify_init1, libc.inotify_add_watch, libc.inotify_rm_watch
+		return libc
+	except (OSError, AttributeError):
+		return None
+
+def stamp(file): # (mtime, size) or None if the file is gone
+	try:
+		s = os.stat(file)
+		return s.st_mtime, s.st_size
+	except OSError:
+		return None
+
+def encoded(path): # inotify wants bytes
+	if isinstance(path, unicode):
+		return path.encode(sys.getfilesystemencoding() or 'utf-8')
+	return path
+
+class fileWatcher(QThread):
+	def __init__(self):
+		QThread.__init__(self)
+		self.lock = threading.Lock()
+		self.files = {} # path: [receivers, stamp]
+		self.dirs = {} # directory: watch descriptor
+		self.stopping = False
+		self.wake = os.pipe() # written to interrupt the wait
+		self.libc = inotify()
+		self.fd = -1
+		if self.libc:
+			self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+			if self.fd < 0:
+				self.libc = None
+		if printme: print >>sys.stderr, 'file watching by', 'inotify' if self.libc else 'polling'
+
+	def watch(self, file, receiver): # receiver.fileChanged is emitted when file changes
+		path = os.path.abspath(file)
+		with self.lock:
+			if path in self.files:
+				self.files[path][0].append(receiver)
+				return
+			self.files[path] = [[receiver], stamp(path)]
+			dir = os.path.dirname(path)
+			if self.libc and dir not in self.dirs:
+				wd = self.libc.inotify_add_watch(self.fd, encoded(dir), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+				if wd >= 0:
+					self.dirs[dir] = wd
+
+	def unwatch(self, file, receiver):
+		path = os.path.abspath(file)
+		with self.lock:
+			if receiver not in self.files.get(path, [[]])[0]:
+				return
+			self.files[path][0].remove(receiver)
+			if self.files[path][0]:
+				return
+			del self.files[path]
+			dir = os.path.dirname(path)
+			if dir in self.dirs and not [f for f in self.files if os.path.dirname(f) == dir]:
+				self.libc.inotify_rm_watch(self.fd, self.dirs.pop(dir))
+
+	def stop(self):
+		self.stopping = True
+		os.write(self.wake[1], 'x')
+
+	def run(self):
+		while not self.stopping:
+			try:
+				changed = self.waitForEvents() if self.libc else self.poll()
+				if changed:
+					time.sleep(SETTLE_TIME)
+					for path in changed:
+						self.check(path)
+			except Exception, e:
+				print >>sys.stderr, e
+				traceback.print_exc(file=sys.stderr)
+				time.sleep(POLL_INTERVAL)
+
+	def waitForEvents(self): # watched files named in inotify events
+		ready = select.select([self.fd, self.wake[0]], [], [])[0]
+		if self.wake[0] in ready:
+			os.read(self.wake[0], 1)
+		if self.fd not in ready:
+			return []
+		try:
+			events = os.read(self.fd, 64 * 1024)
+		except OSError: # nothing left to read
+			return []
+		with self.lock:
+			names = dict((wd, dir) for dir, wd in self.dirs.items())
+			changed = []
+			offset = 0
+			while offset < len(events):
+				wd, mask, cookie, length = EVENT.unpack_from(events, offset)
+				offset += EVENT.size
+				name = events[offset:offset + length].rstrip('\0')
+				offset += length
+				if wd in names:
+					path = os.path.join(names[wd], name)
+					if path in self.files and path not in changed:
+						changed.append(path)
+		return changed
+
+	def poll(self): # watched files with a different mtime or size
+		if select.select([self.wake[0]], [], [], POLL_INTERVAL)[0]:
+			os.read(self.wake[0], 1)
+		with self.lock:
+			return [path for path, (receivers, last) in self.files.items() if stamp(path) != last]
+
+	def check(self, path): # parse a changed file ahead and tell receivers
+		with self.lock:
+			if path not in self.files:
+				return
+			now = stamp(path)
+			if now is None or now == self.files[path][1]:
+				return
+			self.files[path][1] = now
+			receivers = list(self.files[path][0])
+		if printme: print >>sys.stderr, 'file changed:', path
+		if compressed.plainName(path).rsplit('.', 1)[-1] in REPARSE:
+			record = image.imageRecord(None)
+			record.follow = False
+			record.readFile(path) # leaves the parsed image in the image cache
+		for receiver in receivers:
+			receiver.fileChanged.emit(path) # queued to the receiver's thread
+
+watcher = None
+
+def fileWatch(): # the one watcher; started when first asked for
+	global watcher
+	if watcher is None:
+		watcher = fileWatcher()
+		watcher.start()
+	return watcher
+
+def watch(file, receiver):
+	if file:
+		fileWatch().watch(file, receiver)
+
+def unwatch(file, receiver):
+	if file and watcher:
+		watcher.unwatch(file, receiver)
+
+def stopWatching():
+	if watcher:
+		watcher.stop()
+		if useQt():
+			watcher.wait(1000)
+		else:
+			watcher.join(1)
+
+atexit.register(stopWatching)
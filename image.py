@@ -2,27 +2,34 @@
 
 from pyqtapi2 import *
 
-import sys, traceback
+import sys, traceback, binascii, zlib, json
 from message import *
-from checksum import fletcher32
+from segmentmap import segmentMap
+from buildversion import extractNameDateVersion
+from elffile import elfFile, elfError, ET_EXEC
+import imagecache, imagestore, imagediff, filewatch, imagewriter, compressed
 import os
-from ctypes import *
 
 printme = 0
+RECORD_BATCH = 4096 # decoded records held before they are copied into the segments
 
 class imageRecord(QObject):
-	MAX_IMAGE_SIZE = 1024 * 1024 * 2 # 2MB
+	MAX_IMAGE_SIZE = 64 * 1024 * 1024 # 64MB; segments over segmentmap.SPILL_SIZE are file backed
 	HOLE_FILL = 0xFF
 	setSize = Signal(object)
 	setName = Signal(object)
 	setStart = Signal(object)
 	imageLoaded = Signal()
+	fileChanged = Signal(object) # from the file watcher thread
+	loadProgress = Signal(object) # fraction of the file parsed
 
 	def __init__(self, parent):
 		QObject.__init__(self) # needed for signals to work!!
 		self.parent = parent
-		self.records = []
-		self.image = []
+		self.records = [] # decoded records not yet copied into the segments
+		self.recorded = 0 # records already copied in
+		self.segments = segmentMap(self.HOLE_FILL)
+		self.start = 0
 		self.file = ''
 		self.dir = ''
 		self.name = ''
@@ -30,21 +37,38 @@ class imageRecord(QObject):
 		self.size = 0
 		self.checksum = 0
 		self.ext = ''
+		self.strict = False # verify record checksums and counts; reject the image on any error
+		self.badLines = []
+		self.overlapPolicy = 'warn' # error: reject the image; warn: report and keep the last data; last: keep the last data
+		self.overlaps = [] # address ranges given by more than one record
+		self.follow = True # reload when the file changes on disk
+		self.watched = ''
+		self.versions = {} # (name, date, version) by endianness
+		self.loaders = [] # background loads still running
+		self.base = 0 # load address for a raw binary without a sidecar
+		self.packed = None # compression of the file: gzip, bz2, xz, lzma
+		self.stored = None # image in the image store shared with other records
+		self.changes = [] # address ranges changed by the last reload
+		self.pending = ''
 
 	def createImage(self, file):
 		if file:
-			if printme: print("Creating Image for: "+file)
-			self.file = file
-			x = self.file.rsplit('/', 1)
-			if len(x) > 1:
-				self.dir, self.name = x
-			else:
-				self.name = x[0]
-
-			self.ext = self.name.rsplit('.', 1)[-1]
-			self.addRecord()
+			self.readFile(file)
+			self.watchFile()
 			self.imageLoaded.emit()
 
+	def readFile(self, file): # createImage without signals; safe from any thread
+		if printme: print("Creating Image for: "+file)
+		self.file = file
+		x = self.file.rsplit('/', 1)
+		if len(x) > 1:
+			self.dir, self.name = x
+		else:
+			self.name = x[0]
+
+		self.ext = compressed.plainName(self.name).rsplit('.', 1)[-1] # app.hex.gz is hex
+		self.addRecord()
+
 	def selectFile(self, file):
 		if not file: return
 		try:
@@ -56,56 +80,255 @@ class imageRecord(QObject):
 			print >>sys.stderr, e
 			traceback.print_exc(file=sys.stderr)
 	
+	def loadFile(self, file): # selectFile with the parsing done by a worker thread
+		if not file: return
+		self.pending = file
+		loader = imageLoader(self, file)
+		loader.progress.connect(self.loadProgress.emit)
+		loader.loaded.connect(self.imageParsed)
+		self.loaders.append(loader)
+		loader.start()
+
+	def imageParsed(self, result): # on this object's thread once a loader is done
+		loader, record = result
+		loader.finish()
+		self.loaders.remove(loader)
+		if record.file != self.pending: # a later load was asked for
+			return
+		try:
+			self.adopt(record)
+			self.watchFile()
+			self.imageLoaded.emit()
+			self.setName.emit(self.name)
+			self.setSize.emit(str(self.size))
+			self.setStart.emit(hex(self.start))
+		except Exception, e:
+			print >>sys.stderr, e
+			traceback.print_exc(file=sys.stderr)
+
+	def writeImage(self, file, length=None): # write the image out as .srec, .S19, .hex or .bin
+		imagewriter.writeImage(self.segments, file, self.start, max(self.start, self.end),
+			self.entry, length, self.HOLE_FILL, self.name)
+
+	def rebase(self, start): # move the image to a new start address
+		delta = start - self.start
+		self.release()
+		self.segments = self.segments.moved(delta)
+		self.start += delta
+		self.end += delta
+
+	def adopt(self, record): # take over an image parsed by another record
+		self.file, self.dir, self.name, self.ext = record.file, record.dir, record.name, record.ext
+		self.timestamp = record.timestamp
+		self.segments = record.segments
+		self.start, self.end, self.entry = record.start, record.end, record.entry
+		self.size, self.checksum = record.size, record.checksum
+		self.badLines, self.overlaps = record.badLines, record.overlaps
+		self.versions = record.versions
+		self.release()
+		if record.stored:
+			self.stored = record.stored
+			imagestore.hold(self.stored, self)
+
+	def watchFile(self): # follow the current file; the watcher parses it again when it changes
+		if not self.follow or self.watched == self.file:
+			return
+		if not self.watched:
+			self.fileChanged.connect(self.fileUpdated)
+		filewatch.unwatch(self.watched, self)
+		filewatch.watch(self.file, self)
+		self.watched = self.file
+
+	def fileUpdated(self, file): # the new contents are already in the image cache
+		if file == os.path.abspath(self.file) and not self.busy():
+			self.checkUpdates()
+
+	def busy(self): # reloading is left until the next send while this is true
+		return False
+
 	def checkUpdates(self):
 		if self.timestamp != os.path.getmtime(self.file):
 			warning(' disk image is newer - reloading ')
+			old = self.segments
 			self.selectFile(self.file)
+			self.reportChanges(old)
 			return True
 		return False
 
+	def reportChanges(self, old): # how much of the image a reload changed
+		if old and self.segments:
+			self.changes = imagediff.diff(old, self.segments)
+			note(' %s'%imagediff.summary(self.changes, old, self.segments))
+
 	def addRecord(self): # turn file into list of address,data tuples
 		self.timestamp = os.path.getmtime(self.file) # remember for checking later
+		self.release()
 		self.start = 0xFFFFFFFF
 		self.end = self.entry = self.size = 0
 		del self.records[:]
+		self.recorded = 0
+		del self.badLines[:]
+		self.overlaps = []
+		self.versions = {}
+		parsed = False
+		try:
+			self.packed = compressed.compression(self.file)
+			if self.packed:
+				compressed.decompressor(self.packed)
+		except IOError, e:
+			error('%s: %s'%(e, self.name))
+			self.start = 0
+			return
+		if self.ext == 'bin': # placed before the key is made as placement is part of it
+			self.start, self.entry = self.binPlacement()
+		key = self.storeKey()
+		stored = imagestore.get(key, self) if key else None
+		if stored:
+			self.share(stored)
+			return
 
 		if self.ext in ['jbc', 'jam', 'txt', 'text']:
 			self.emptyImage()
-			self.image.extend(map(ord, open(self.file,'rb').read()))
-			self.end = self.size = len(self.image)
+			self.segments.add(0, compressed.openFile(self.file,'rb').read())
+			self.end = self.size = self.segments.end()
+		elif self.ext in ['bin']:
+			self.addBinRecord()
+		elif self.ext not in ['srec', 'S19', 'hex', 'elf']:
+			error('Unknown format. File suffix not any of: .hex, .srec, .S19, .elf, .bin, .jbc, .jam, .txt, .text: %s'%self.name)
+			self.start = 0
+			return
+		elif self.loadCached():
+			self.store(key)
+			return
 		else:
+			self.emptyImage() # records are copied in as they are parsed
 			if self.ext in ['srec', 'S19']: self.addSrecord()
 			elif self.ext in ['hex']: self.addHexRecord()
 			elif self.ext in ['elf']: self.addElfRecord()
-			else:
-				error('Unknown format. File suffix not any of: .hex, .srec, .S19, .elf, .jbc, .jam, .txt, .text: %s'%self.name)
-				self.start = 0
-				return
 			self.makeImage()
+			del self.records[:] # decoded data now lives in the segments; releases any file mapping
+			parsed = True
 		if self.start == 0xFFFFFFFF:
 			self.start = 0
-		self.checksum = fletcher32(self.image, len(self.image))
+		self.checksum = self.segments.fletcher32(self.start, self.start + self.size) if self.segments else 0
+		if parsed and self.segments and not self.badLines:
+			self.cacheImage()
+		self.store(key)
+
+	# loaded images are shared through the image store so a file is held once
+	def storeKey(self): # what makes two loads the same image; None if not shared
+		try:
+			digest = imagestore.contentHash(self.file)
+		except (IOError, OSError):
+			return None
+		placement = (self.start, self.entry) if self.ext == 'bin' else None # binaries go where they are put
+		return (digest, self.ext, self.strict, self.overlapPolicy, self.MAX_IMAGE_SIZE, self.HOLE_FILL, placement)
+
+	def store(self, key):
+		if key and self.segments and not self.badLines:
+			self.share(imagestore.put(key, self))
+
+	def share(self, stored): # use a stored image; its segments are not to be changed
+		self.stored = stored
+		self.segments = stored.segments
+		self.start, self.end, self.entry = stored.start, stored.end, stored.entry
+		self.size, self.checksum = stored.size, stored.checksum
+		self.overlaps, self.versions = stored.overlaps, stored.versions
+
+	def release(self): # stop sharing a stored image
+		if self.stored:
+			imagestore.release(self.stored, self)
+			self.stored = None
+
+	# parsed images are cached on disk so an unchanged file is not parsed again
+	def loadCached(self):
+		entry = imagecache.load(self.file)
+		if not entry or 'raw' in entry or (self.strict and not entry['strict']): # checksums not yet verified
+			return False
+		self.emptyImage()
+		self.overlaps = entry['overlaps']
+		if not self.checkOverlaps():
+			self.start = 0
+			return True
+		for address, data in entry['segments']:
+			self.segments.add(address, bytearray(data), merge=False)
+		self.start, self.end, self.entry = entry['start'], entry['end'], entry['entry']
+		self.size, self.checksum = entry['imageSize'], entry['checksum']
+		self.versions = dict(entry['versions'])
+		return True
+
+	def cacheImage(self): # file backed images are not cached; reading one back would fill memory
+		if self.segments.size() > self.segments.spill:
+			return
+		segments = [(address, str(buffer)) for address, buffer in self.segments]
+		versions = dict((e, self.nameDateVersion(e)) for e in ['big', 'little'])
+		imagecache.store(self.file, dict(segments=segments, start=self.start, end=self.end,
+			entry=self.entry, imageSize=self.size, checksum=self.checksum, versions=versions,
+			strict=self.strict, overlaps=self.overlaps))
+
+	def nameDateVersion(self, endianness='big'): # application name, date and version in the image
+		if endianness not in self.versions:
+			self.versions[endianness] = extractNameDateVersion(self.segments, endianness)
+		return self.versions[endianness]
+
+	@property
+	def image(self): # flat image from start with holes filled; built only when asked for
+		if not self.segments:
+			return bytearray()
+		return self.segments.flatten(self.start, self.start + self.size)
+
+	def emptyImage(self): # rebind rather than clear; views may still be exported
+		self.release()
+		self.segments = segmentMap(self.HOLE_FILL)
+
+	def checkOverlaps(self): # apply the overlap policy; False if the image is rejected
+		if not self.overlaps or self.overlapPolicy == 'last':
+			return True
+		ranges = ', '.join('%x-%x'%o for o in self.overlaps[:20])
+		if len(self.overlaps) > 20:
+			ranges += ' ...'
+		if self.overlapPolicy == 'error':
+			error('%d overlapping ranges in %s: %s'%(len(self.overlaps), self.name, ranges))
+			error('Image rejected.')
+			return False
+		warning('\nimageRecord.makeImage: Overwrite data in %s'%ranges)
+		return True
 
-	def emptyImage(self):
-		del self.image[:]
-		
-	def makeImage(self): # direct memory image from hex strings with holes as 0xFF
+	def window(self, offset, length): # zero copy view of part of the image unless it spans a hole
+		return self.segments.read(self.start + offset, length)
+
+	def addBatch(self): # copy the records held into the segments so a file's records are never all held
+		if self.records:
+			self.overlaps.extend(self.segments.addRecords(self.records))
+			self.recorded += len(self.records)
+			del self.records[:]
+
+	def rejectRecords(self): # nothing parsed so far is kept
+		del self.records[:]
+		self.recorded = 0
 		self.emptyImage()
-		self.size = self.end - self.start
+
+	def makeImage(self): # sparse memory image from the records parsed; holes are left out
+		self.addBatch()
+		overlaps = []
+		for low, high in sorted(self.overlaps): # batches report their overlaps separately
+			if overlaps and low <= overlaps[-1][1]:
+				overlaps[-1] = (overlaps[-1][0], max(overlaps[-1][1], high))
+			else:
+				overlaps.append((low, high))
+		self.overlaps = overlaps
+		if not self.checkOverlaps():
+			self.emptyImage()
+			return
+		if self.segments:
+			self.start = min(self.start, self.segments.start())
+			self.end = max(self.end, self.segments.end())
+		self.size = max(0, self.end - self.start)
 		self.size = (self.size + 3) & ~3  # round up to multiple of 4
-		if self.size > self.MAX_IMAGE_SIZE:
-			error('Image is too large! %d'%self.size)
-		else:
-			self.image = [self.HOLE_FILL]*self.size
-			if printme: print("Size: %d"%self.size)
-			for record in self.records:
-				a = record[0] - self.start
-				data = record[1]
-				if printme: print(" a = %x  data = %s "%(a,data[0:20]))
-				for i in range(0,len(data),2):
-					if self.image[a+i/2] != 0xFF:
-						warning('\nimageRecord.makeImage: Overwrite data at %x'%(self.start + a + i/2))
-					self.image[a+i/2] = int(data[i:i+2], 16)
+		if printme: print("Start: %X  End: %X  Size: %d"%(self.start, self.end, self.size))
+		if self.segments.size() > self.MAX_IMAGE_SIZE:
+			error('Image is too large! %d'%self.segments.size())
+			self.emptyImage()
 	
 	'''
 	Intel Hex format from Wikipedia:
@@ -115,37 +338,56 @@ class imageRecord(QObject):
 	  [3:6] address
 	  [7:8] type: 00 data; 01 end; 02 ext seg; 03 seg start; 04 ext addr; 05 lin start
 	  [9:-2] data
-	  [-2:] checksum: 2's complement of sump of all preceding bytes; ignored
+	  [-2:] checksum: 2's complement of sump of all preceding bytes; checked when strict
+	Each line after the colon is decoded to bytes with one unhexlify call and the
+	record keeps its data as bytes rather than as hex text. In strict mode the
+	decoded bytes, checksum included, must sum to zero. The sum is taken from the
+	low half of adler32 which is 1 + sum of bytes, exact while the sum stays
+	under 65521; records of more than 251 data bytes are summed directly.
 	'''
 	def addHexRecord(self):
+		strict = self.strict
+		adler32 = zlib.adler32
 		try:
 			base = 0
-			for line in open(self.file, 'r').readlines():
+			file = compressed.openFile(self.file, 'r')
+			for number, line in enumerate(file, 1):
+				if not number & 0xFFF:
+					self.parsed(file)
 				line = line.strip()
 				if line:
 					if line[0] == ':':
-						count = int(line[1:3], 16)
-						address = int(line[3:7], 16) + base
-						type = int(line[7:9])
-						data = line[9:-2]
-						checksum = line[-2:]
+						try:
+							record = binascii.unhexlify(line[1:])
+						except (TypeError, binascii.Error): # odd length or not hex
+							self.badLines.append(number)
+							continue
+						count = ord(record[0])
+						if strict and (count != len(record) - 5 or
+						  (adler32(record) if count < 252 else sum(bytearray(record)) + 1) & 0xFF != 1):
+							self.badLines.append(number)
+							continue
+						address = (ord(record[1]) << 8 | ord(record[2])) + base
+						type = ord(record[3])
 						if type == 0:
-							self.records.append((address,data))
-							self.start = min(self.start, address)
-							self.end = max(self.end, address + len(data)/2)
+							self.records.append((address, record[4:4+count]))
+							if len(self.records) >= RECORD_BATCH:
+								self.addBatch()
 						elif type == 1:
 							pass # end of file
 						elif type == 2:
-							base = int(data, 16) * 16
+							base = int(line[9:-2], 16) * 16
 						elif type == 4:
-							base = int(data, 16) << 16
+							base = int(line[9:-2], 16) << 16
 						elif type == 3 or type == 5:
-							self.entry = int(data, 16)
+							self.entry = int(line[9:-2], 16)
 						else:
 							raise Exception('Unknown hex record:%s'%line)
-			if printme: print("Start: %X  End: %X"%(self.start, self.end))
 		except:
 			error('Error parsing hex-record file! Unknown format')
+			if strict:
+				self.rejectRecords()
+		self.reportBadLines('hex')
 
 	''' S-Record file description from Wikipedia:
 	Components
@@ -167,7 +409,11 @@ class imageRecord(QObject):
 		[2:4] count
 		[4:8,10,12] address
 		[:-2] data
-		[-2:] checksum; ignored
+		[-2:] checksum; checked when strict
+	As with hex records, each line after the type is decoded with one unhexlify
+	call and data records keep bytes. In strict mode the decoded bytes must sum
+	to 0xFF and an S5 or S6 count must match the data records before it. At most
+	256 bytes follow the type so the adler32 sum used for hex records is exact.
 
 	There are eight record types, listed below:
 	Record 	Description 	Address Bytes 	Data Sequence
@@ -196,29 +442,37 @@ class imageRecord(QObject):
 	address for the program.
 	'''
 	def addSrecord(self):
+		strict = self.strict
+		adler32 = zlib.adler32
 		try:
-			for line in open(self.file, 'r').readlines():
+			file = compressed.openFile(self.file, 'r')
+			for number, line in enumerate(file, 1):
+				if not number & 0xFFF:
+					self.parsed(file)
 				line = line.strip()
 				if not line:
 					continue
 				if line[0] == 'S':
 					s = line[1]
-					count = line[2:4]
-					checksum = line[-2:]
-					if   s == '1':
-						address = int(line[4:8], 16)
-						data = line[8:-2]
-					elif s == '2':
-						address = int(line[4:10], 16)
-						data = line[10:-2]
-					elif s == '3':
-						address = int(line[4:12], 16)
-						data = line[12:-2]
+					if s in ('1', '2', '3') or strict:
+						try:
+							record = binascii.unhexlify(line[2:])
+						except (TypeError, binascii.Error): # odd length or not hex
+							self.badLines.append(number)
+							continue
+						if strict and (ord(record[0]) != len(record) - 1 or adler32(record) & 0xFF != 0):
+							self.badLines.append(number)
+							continue
+					if s in ('1', '2', '3'):
+						n = int(s) + 1 # address bytes
+						address = int(line[4:4+2*n], 16)
+						data = record[1+n:-1]
 					else:
 						if   s == '0':
 							data = line[8:-2]
-						elif   s == '5':
-							pass
+						elif s == '5' or s == '6':
+							if strict and int(line[4:-2], 16) != self.recorded + len(self.records):
+								self.badLines.append(number)
 						elif s == '7':
 							self.entry = int(line[4:12], 16)
 						elif s == '8':
@@ -229,10 +483,85 @@ class imageRecord(QObject):
 							raise Exception('Unknown s record:%s'%line)
 						continue
 					self.records.append((address,data))
-					self.start = min(self.start, address)
-					self.end = max(self.end, address+len(data)/2)
+					if len(self.records) >= RECORD_BATCH:
+						self.addBatch()
 		except:
 			error('Error parsing s-record file! Unknown format')
+			if strict:
+				self.rejectRecords()
+		self.reportBadLines('s-record')
+
+	def parsed(self, file): # progress through a file being parsed
+		self.reportProgress(float(file.tell()) / max(1, os.fstat(file.fileno()).st_size))
+
+	def reportProgress(self, fraction): # loaders replace this for their records
+		self.loadProgress.emit(fraction)
+
+	def reportBadLines(self, kind): # bad records leave holes; in strict mode nothing is kept
+		if self.badLines:
+			lines = ', '.join(map(str, self.badLines[:20]))
+			if len(self.badLines) > 20:
+				lines += ' ...'
+			error('%d bad %s lines in %s: %s'%(len(self.badLines), kind, self.name, lines))
+			if self.strict:
+				error('Image rejected.')
+				self.rejectRecords()
+
+	'''
+	Raw binary: the file is the image. It is read straight into the segment,
+	a spill file if large, with nothing decoded; a compressed binary is
+	decompressed into the segment instead, and the decompressed bytes are kept
+	in the image cache so an unchanged file is decompressed once. The image
+	holds its own copy so a rebuild rewriting the file leaves the old image
+	readable for the diff against the new one. Loaded binaries are shared
+	through the image store by content and placement. The load address
+	and entry point come from a sidecar file of the same name plus .json,
+	  {"base": "0x08000000", "entry": "0x08000101"}
+	or else base is used and may be changed later with rebase.
+	'''
+	def binPlacement(self): # (load address, entry) from the sidecar or base
+		start, entry = self.base, 0
+		sidecar = self.file + '.json'
+		if os.path.exists(sidecar):
+			try:
+				info = json.load(open(sidecar))
+				number = lambda x: int(x, 0) if isinstance(x, basestring) else int(x)
+				start = number(info.get('base', self.base))
+				entry = number(info.get('entry', 0))
+			except Exception, e:
+				error('Bad sidecar file %s: %s'%(sidecar, e))
+		return start, entry
+
+	def unpackBin(self): # decompressed contents of a binary or None; from the image cache if current
+		entry = imagecache.load(self.file)
+		if entry and entry.get('raw') is not None:
+			return entry['raw']
+		try:
+			data = compressed.openFile(self.file).read(self.MAX_IMAGE_SIZE + 1)
+		except IOError, e:
+			error(str(e))
+			return None
+		if len(data) > self.MAX_IMAGE_SIZE:
+			error('Image is too large! %d'%len(data))
+			return None
+		if len(data) <= self.segments.spill: # as with parsed images, file backed ones are not cached
+			imagecache.store(self.file, dict(raw=data))
+		return data
+
+	def addBinRecord(self): # placed by binPlacement first
+		self.emptyImage()
+		if self.packed: # decompressed into memory or a spill file
+			data = self.unpackBin()
+			if data is None:
+				return
+			self.segments.add(self.start, data)
+		elif os.path.getsize(self.file) > self.MAX_IMAGE_SIZE:
+			error('Image is too large! %d'%os.path.getsize(self.file))
+			return
+		else:
+			self.segments.load(self.start, self.file)
+		self.end = self.start + self.segments.size()
+		self.size = (self.end - self.start + 3) & ~3 # round up to multiple of 4
 
 	''' ELF file format: ELF file main Header format:
 		Byte	ident[16]; 0x7f 3 chars; class; encoding; version; 
@@ -252,86 +581,58 @@ class imageRecord(QObject):
 	Program headers start at phoff and there are phnum of them. They contain
 	information about the parts to build the image.
 	'''
-	def addElfRecord(self):
+	def addElfRecord(self): # segments are copied from the mapped file by makeImage
 		if printme: print("adding elf record")
-		# named constants
-		EI_MAG0, EI_MAG1, EI_MAG2, EI_MAG3, EI_CLASS, EI_DATA, EI_VERSION, EI_PAD, EI_NIDENT = range(8) + [16]
-		ELFMAG0, ELFMAG1, ELFMAG2, ELFMAG3 = '\x7f', 'E', 'L', 'F'
-		ELFCLASSNONE, ELFCLASS32, ELFCLASS64 = range(3)
-		ELFDATANONE, ELFDATA2LSB, ELFDATA2MSB = range(3)
-		ET_NONE, ET_REL, ET_EXEC, ET_DYN, ET_CORE = range(5)
-		EM_NONE, EM_M32, EM_SPARC, EM_386, EM_68K, EM_88K, EM_86O, EM_MIPS, EM_ARM = range(6) + [7,8,0x28]
-
-		def elfHeader(base):
-			class elfHeaderBase(base):
-				_fields_ = [('ident', c_ubyte * EI_NIDENT),
-							('type', c_ushort),
-							('machine', c_ushort),
-							('version', c_uint32),
-							('entry', c_uint32),
-							('phoff', c_uint32),
-							('shoff', c_uint32),
-							('flags', c_uint32),
-							('ehsize', c_ushort),
-							('phentsize', c_ushort),
-							('phnum', c_ushort),
-							('shentsize', c_ushort),
-							('shnum', c_ushort),
-							('shstrndx', c_ushort)]
-			return elfHeaderBase()
-
-		# format of program headers used to find image sections
-		def programHeader(base):
-			class programHeaderBase(base):
-				_fields_ = [('p_type', c_uint32),
-							('p_offset', c_uint32),
-							('p_vaddr', c_uint32),
-							('p_paddr', c_uint32),
-							('p_filesz', c_uint32),
-							('p_memsz', c_uint32),
-							('p_flags', c_uint32),
-							('p_align', c_uint32)]
-			return programHeaderBase()
-
-		# determine endian
-		file = open(self.file, 'rb')
-		file.seek(EI_DATA)
-		if ord(file.read(1)) == ELFDATA2MSB:
-			endian = BigEndianStructure
-		else:
-			endian = LittleEndianStructure
+		try:
+			elf = elfFile(self.file)
+			if elf.type != ET_EXEC:
+				error('Not an executable file')
+				return
+			self.entry = int(elf.entry)
+			for address, data in elf.segments():
+				self.records.append((address, data))
+				self.start = min(self.start, address)
+				self.end = max(self.end, address+len(data))
+				if printme: print("address: %x  start: %x  end: %x"%(address, self.start, self.end))
+		except elfError, e:
+			error(str(e))
+			self.rejectRecords()
 
-		# elf header
-		elf = elfHeader(endian)
-		file.seek(EI_MAG0)
-		file.readinto(elf)
-	
-		if elf.ident[EI_MAG0:EI_CLASS] != map(ord, [ELFMAG0, ELFMAG1, ELFMAG2, ELFMAG3]):
-			error('Not an elf file')
-			return
+class imageLoader(QThread):
+	'''
+	Parse a file for a record without blocking its thread. A new record is
+	made in the worker thread with the same options, so the image being used
+	is untouched until loaded delivers (loader, record) to be adopted.
+	'''
+	progress = Signal(object)
+	loaded = Signal(object)
 
-		if elf.type != ET_EXEC:
-			error('Not an executable file')
-			return
+	def __init__(self, owner, file):
+		QThread.__init__(self)
+		self.file = file
+		self.strict = owner.strict
+		self.overlapPolicy = owner.overlapPolicy
+		self.maxSize = owner.MAX_IMAGE_SIZE
+		self.base = owner.base
 
-		self.entry = int(elf.entry)
+	def run(self):
+		record = imageRecord(None)
+		record.follow = False
+		record.strict = self.strict
+		record.overlapPolicy = self.overlapPolicy
+		record.MAX_IMAGE_SIZE = self.maxSize
+		record.base = self.base
+		record.reportProgress = self.progress.emit
+		try:
+			record.readFile(self.file)
+		except Exception, e:
+			print >>sys.stderr, e
+			traceback.print_exc(file=sys.stderr)
+		self.progress.emit(1)
+		self.loaded.emit((self, record))
 
-		# program headers
-		ph = programHeader(endian)
-	
-		for i in range(elf.phnum):
-			file.seek(elf.phoff + i * sizeof(ph))
-			file.readinto(ph)
-			# image
-			if ph.p_filesz:
-				address = int(ph.p_paddr)
-				file.seek(ph.p_offset)
-				data = file.read(ph.p_filesz).encode("hex")
-				self.records.append((address,data))
-				self.start = min(self.start, address)
-				self.end = max(self.end, address+len(data)/2)
-				if printme: print("address: %x  start: %x  end: %x"%(address, self.start, self.end))
-				
-		file.close()
+	def finish(self): # loaded is the last thing run does
+		if useQt(): # machines signals call straight through on this thread
+			self.wait()
 
 # unit test code: convert srec and hex file to images and compare checksums
\ No newline at end of file
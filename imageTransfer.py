@@ -5,13 +5,13 @@ from pyqtapi2 import *
 import sys, traceback	
 from endian import *
 from message import *
-from checksum import fletcher32
-import image
+import image, payloads
 from transfer import *
 
 class imageTransfer(image.imageRecord):
 	setProgress = Signal(object)
 	setAction = Signal(object)
+	transferFinished = Signal(object) # True if the target took it
 	# perhaps the following parameters should be in the children files which use SFP
 	# or bring pids into this module and have it as an SFP transfer but make a super
 	# class which is protocol independant
@@ -32,6 +32,9 @@ class imageTransfer(image.imageRecord):
 		self.protocol = self.parent.protocol
 		
 
+	def busy(self):
+		return self.transferTimer.isActive()
+
 	def who(self):
 		return self.parent.parent.who() # packet routing
 
@@ -39,8 +42,11 @@ class imageTransfer(image.imageRecord):
 	def sendFile(self):
 		if self.transferTimer.isActive():
 			self.abort()
+		elif self.loaders:
+			error('Image is still loading.')
+			self.transferFinished.emit(False)
 		else:
-			if self.image:
+			if self.segments:
 				self.checkUpdates()
 				self.startTransferTime = time.time()
 				self.setProgress.emit(0)
@@ -50,6 +56,7 @@ class imageTransfer(image.imageRecord):
 				self.setAction.emit('Abort')
 			else:
 				error("No image for downloading")
+				self.transferFinished.emit(False)
 		
 	def setupTransfer(self):
 		pass
@@ -71,7 +78,7 @@ class imageTransfer(image.imageRecord):
 			else:
 				sendsize = self.left
 				self.left = 0
-			self.transferData(self.image[self.pointer:self.pointer+sendsize])
+			self.transferData(self.window(self.pointer, sendsize))
 			self.setProgress.emit((self.size - self.left)/self.size)
 			self.i += 1
 			self.pointer += sendsize
@@ -84,22 +91,26 @@ class imageTransfer(image.imageRecord):
 
 	# states
 	def requestTransfer(self):
-		size = longList(self.size)
-		name = [len(self.name)] + list(self.name)
-		type = [self.transferType]
-		payload = self.who() + [TRANSFER_REQUEST] + size + name + type
+		whoto, whofrom = self.who()
+		payload = payloads.transferRequest.encode(whoto, whofrom, TRANSFER_REQUEST, self.size, self.name, self.transferType)
 		self.protocol.sendNPS(self.transferPid, payload)
 	
 	def transferData(self, data):
-		payload = self.who() + [TRANSFER_DATA] + longList(self.i) + data
+		whoto, whofrom = self.who()
+		payload = payloads.transferData.encode(whoto, whofrom, TRANSFER_DATA, self.i, data)
 		self.protocol.sendNPS(self.transferPid, payload)
 	
 	def transferDone(self):
-		payload = self.who() + [TRANSFER_DONE] + longList(self.checksum)
+		whoto, whofrom = self.who()
+		payload = payloads.transferDone.encode(whoto, whofrom, TRANSFER_DONE, self.checksum)
 		self.protocol.sendNPS(self.transferPid, payload)
 
 	def transferResponse(self, packet):
-		spid, result = cast('BBBB', packet)[2:4]
+		reply = payloads.transferReply.decode(packet)
+		if reply is None:
+			self.abort()
+			return
+		spid, result = reply.spid, reply.result
 		if spid == TRANSFER_REPLY:
 			if result == REQUEST_OK:
 				note('Request approved. Starting data transfer...')
@@ -110,7 +121,7 @@ class imageTransfer(image.imageRecord):
 		elif spid == TRANSFER_RESULT:
 			if result == TRANSFER_OK:
 				note('Transfer complete')
-				self.finish()
+				self.finish(True)
 			else:
 				error('Transfer failed. '+resultText.get(result,'Unknown'))
 				self.abort()
@@ -127,11 +138,12 @@ class imageTransfer(image.imageRecord):
 		error('Transfer aborted.')
 		self.finish()
 
-	def finish(self):
+	def finish(self, ok=False):
 		self.transferTimer.stop()
 		self.setAction.emit('Transfer')
 		elapsed = time.time() - self.startTransferTime
 		message(' finished in %.1f seconds'%elapsed,'note')
+		self.transferFinished.emit(ok)
 
 	# receive file
 	def getFile(self):
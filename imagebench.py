@@ -0,0 +1,104 @@
+# image loading benchmarks
+
+'''
+Times image loading on synthetic files. Run from a command line:
+ imagebench.py [size in bytes]
+A random image of the given size (default 2MB) is written as Intel hex and
+as S-records to a temporary directory, then loaded by imageRecord and by the
+original per byte hex string decoder for comparison. The strict column is
+imageRecord with record checksums verified and the cached column is a reload
+of the file after its mtime changed, served from the parsed image cache.
+'''
+import os, sys, time, random, tempfile, shutil
+import image, imagecache, imagestore
+from checksum import fletcher32
+from imagewriter import hexRecord, srecord
+
+def writeTestHex(file, data, address, length=16):
+	out = open(file, 'w')
+	high = None
+	for i in range(0, len(data), length):
+		a = address + i
+		if a >> 16 != high:
+			high = a >> 16
+			out.write(hexRecord(4, 0, chr(high >> 8) + chr(high & 0xFF)))
+		out.write(hexRecord(0, a & 0xFFFF, data[i:i+length]))
+	out.write(hexRecord(1, 0))
+	out.close()
+
+def writeTestSrec(file, data, address, length=32):
+	out = open(file, 'w')
+	out.write(srecord('0', 0, 'imagebench'))
+	for i in range(0, len(data), length):
+		out.write(srecord('3', address + i, data[i:i+length]))
+	out.write(srecord('7', address))
+	out.close()
+
+# the load imageRecord did before records were decoded with binascii
+def legacyLoad(file):
+	records, start, end = [], 0xFFFFFFFF, 0
+	hex = file.endswith('.hex')
+	base = 0
+	for line in open(file, 'r').readlines():
+		line = line.strip()
+		if hex and line[0] == ':':
+			address = int(line[3:7], 16) + base
+			type = int(line[7:9])
+			data = line[9:-2]
+			if type == 0:
+				records.append((address, data))
+				start, end = min(start, address), max(end, address + len(data)/2)
+			elif type == 4:
+				base = int(data, 16) << 16
+		elif not hex and line[0] == 'S' and line[1] == '3':
+			address = int(line[4:12], 16)
+			data = line[12:-2]
+			records.append((address, data))
+			start, end = min(start, address), max(end, address + len(data)/2)
+	image = [0xFF]*(end - start)
+	for address, data in records:
+		a = address - start
+		for i in range(0, len(data), 2):
+			if image[a+i/2] != 0xFF:
+				pass
+			image[a+i/2] = int(data[i:i+2], 16)
+	fletcher32(image, len(image))
+	return image
+
+def timed(f, *args):
+	t = time.time()
+	result = f(*args)
+	return time.time() - t, result
+
+def benchmark(size=2*1024*1024, address=0x08000000):
+	dir = tempfile.mkdtemp()
+	imagecache.directory = os.path.join(dir, 'cache')
+	try:
+		data = ''.join(chr(random.randrange(256)) for i in range(size))
+		for name, writer in [('test.hex', writeTestHex), ('test.srec', writeTestSrec)]:
+			file = os.path.join(dir, name)
+			writer(file, data, address)
+			old, flat = timed(legacyLoad, file)
+			record = image.imageRecord(None)
+			record.follow = False # no watcher thread while timing
+			imagecache.enabled = False
+			new, result = timed(record.createImage, file)
+			same = str(bytearray(flat)) == str(record.image)
+			record.strict = True
+			strict, result = timed(record.createImage, file)
+			same = same and str(bytearray(flat)) == str(record.image)
+			imagecache.enabled = True
+			imagestore.clear() # held images would be used before the disk cache is filled
+			record.createImage(file) # fills the cache
+			os.utime(file, (time.time() + 10, time.time() + 10)) # touched, not changed
+			imagestore.clear() # so the reload comes from the disk cache, not memory
+			cached, result = timed(record.createImage, file)
+			same = same and str(bytearray(flat)) == str(record.image)
+			print '%-10s %8d bytes  legacy %6.2fs  binascii %6.3fs  %5.1fx  strict %6.3fs %+4.0f%%  cached %6.3fs  %s'% \
+				(name, size, old, new, old/new, strict, 100*(strict - new)/new, cached, 'same' if same else 'DIFFERENT')
+	finally:
+		imagecache.directory = None
+		shutil.rmtree(dir)
+
+if __name__ == '__main__':
+	benchmark(int(sys.argv[1], 0) if len(sys.argv) > 1 else 2*1024*1024)
@@ -0,0 +1,100 @@
+# cache of parsed images on disk
+
+'''
+Parsing a large hex or S-record file takes a noticeable time and build tools
+often touch files without changing them. Parsed images are kept in a user
+cache directory, one entry per source path, holding the segments, start, end,
+entry, size, fletcher32, overlapping ranges and version information for both
+endians. A small meta file beside each entry holds what is needed to decide if
+it is current.
+
+An entry is used when the file's mtime and size match. When only the mtime
+differs the file contents are hashed and, if the hash matches, the entry is
+used and its mtime refreshed. Any problem with the cache is treated as a miss.
+'''
+import os, sys, hashlib, tempfile
+import cPickle as pickle
+
+printme = 0
+enabled = True
+directory = None # overrides the platform cache directory
+VERSION = 2 # bump when the entry layout changes
+
+def cacheDir():
+	if directory:
+		return directory
+	if sys.platform == 'darwin':
+		base = os.path.expanduser('~/Library/Caches')
+	elif sys.platform.startswith('win'):
+		base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+	else:
+		base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+	return os.path.join(base, 'TimbreTalk', 'images')
+
+def entryFile(file): # an entry is two files: <name>.meta and <name>.image
+	return os.path.join(cacheDir(), hashlib.sha1(os.path.abspath(file)).hexdigest())
+
+def contentHash(file):
+	digest = hashlib.sha1()
+	with open(file, 'rb') as f:
+		for block in iter(lambda: f.read(1 << 20), ''):
+			digest.update(block)
+	return digest.hexdigest()
+
+def load(file): # cached entry for file or None
+	if not enabled:
+		return None
+	try:
+		stat = os.stat(file)
+		name = entryFile(file)
+		with open(name + '.meta', 'rb') as f:
+			meta = pickle.load(f)
+		if meta['version'] != VERSION or meta['path'] != os.path.abspath(file):
+			return None
+		if meta['size'] != stat.st_size:
+			return None
+		if meta['mtime'] != stat.st_mtime:
+			if meta['hash'] != contentHash(file):
+				return None
+			meta['mtime'] = stat.st_mtime # touched but not changed
+			write(name + '.meta', meta)
+		with open(name + '.image', 'rb') as f:
+			entry = pickle.load(f)
+		if entry['hash'] != meta['hash']:
+			return None
+		if printme: print >>sys.stderr, 'image cache hit: %s'%file
+		return entry
+	except Exception, e:
+		if printme: print >>sys.stderr, 'image cache miss: %s %s'%(file, e)
+		return None
+
+def store(file, entry): # entry holds the parsed image
+	if not enabled:
+		return
+	try:
+		stat = os.stat(file)
+		name = entryFile(file)
+		meta = dict(version=VERSION, path=os.path.abspath(file), size=stat.st_size,
+					mtime=stat.st_mtime, hash=contentHash(file))
+		entry['hash'] = meta['hash']
+		write(name + '.image', entry)
+		write(name + '.meta', meta)
+	except Exception, e:
+		if printme: print >>sys.stderr, 'image cache store failed: %s %s'%(file, e)
+
+def write(target, data): # write all then rename so readers never see part of a file
+	dir = os.path.dirname(target)
+	if not os.path.isdir(dir):
+		os.makedirs(dir)
+	fd, temp = tempfile.mkstemp(dir=dir)
+	with os.fdopen(fd, 'wb') as f:
+		pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+	if sys.platform.startswith('win') and os.path.exists(target):
+		os.remove(target)
+	os.rename(temp, target)
+
+def clear():
+	dir = cacheDir()
+	if os.path.isdir(dir):
+		for name in os.listdir(dir):
+			os.remove(os.path.join(dir, name))
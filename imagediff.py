@@ -0,0 +1,128 @@
+# compare two images block by block
+
+'''
+Images are compared a block at a time over the address ranges either one
+holds. A block is a fixed size aligned page or, given a list of flash
+sectors, the sector it falls in; addresses outside every sector fall back to
+pages. Each block is hashed as the target would hold it, holes filled, so
+data that only fills a hole with erased flash is no change. Block hashes are
+kept with the segment map so comparing against the same image again, as on
+every reload, hashes only the new one.
+
+usage: python imagediff.py old new [block=4096 | block=sector]
+lists the changed ranges between two image files and how much changed.
+'''
+import sys, bisect, hashlib, weakref
+
+PAGE_SIZE = 4096 # default block size
+
+hashCache = weakref.WeakKeyDictionary() # segmentMap: {(granularity, addresses): {block: digest}}
+
+def segmentsOf(image): # segment map of an imageRecord, stored image, cached entry or segmentMap
+	if isinstance(image, dict): # image cache entry
+		from segmentmap import segmentMap
+		segments = segmentMap()
+		for address, data in image['segments']:
+			segments.add(address, bytearray(data), merge=False)
+		return segments
+	return getattr(image, 'segments', image)
+
+class blocks(object): # block boundaries: aligned pages or flash sectors
+	def __init__(self, block=PAGE_SIZE):
+		if isinstance(block, (int, long)):
+			self.size, self.sectors = block, []
+		else: # (address, size) of each sector
+			self.size, self.sectors = PAGE_SIZE, sorted(block)
+		self.starts = [a for a, n in self.sectors]
+		self.key = (self.size, tuple(self.sectors))
+
+	def of(self, address): # (start, end) of the block holding address
+		i = bisect.bisect_right(self.starts, address) - 1
+		if i >= 0 and address < self.starts[i] + self.sectors[i][1]:
+			return self.starts[i], self.starts[i] + self.sectors[i][1]
+		start = address - address % self.size
+		if i + 1 < len(self.starts): # a page never runs into the next sector
+			return start, min(start + self.size, self.starts[i + 1])
+		return start, start + self.size
+
+	def cover(self, ranges): # blocks touching sorted (start, end) ranges, each once
+		last = None
+		for a, e in ranges:
+			address = a
+			while address < e:
+				block = self.of(address)
+				if block != last and (last is None or block[0] >= last[1]):
+					yield block
+					last = block
+				address = block[1]
+
+def union(*maps): # sorted, merged (start, end) ranges holding data in any map
+	ranges = sorted(r for segments in maps for r in segments.extents())
+	merged = []
+	for a, e in ranges:
+		if merged and a <= merged[-1][1]:
+			merged[-1][1] = max(merged[-1][1], e)
+		else:
+			merged.append([a, e])
+	return merged
+
+def blockHashes(segments, grain): # digests of segments' blocks; remembered with the map
+	key = (grain.key, tuple(segments.addresses), segments.fill)
+	return hashCache.setdefault(segments, {}).setdefault(key, {})
+
+def digest(segments, hashes, block):
+	if block not in hashes:
+		start, end = block
+		hashes[block] = hashlib.md5(segments.read(start, end - start)).digest()
+	return hashes[block]
+
+def diff(old, new, block=PAGE_SIZE):
+	'''
+	[start, end] ranges of blocks that differ between old and new, merged
+	where they touch. block is a size or a list of (address, size) sectors.
+	'''
+	old, new = segmentsOf(old), segmentsOf(new)
+	grain = blocks(block)
+	oldHashes, newHashes = blockHashes(old, grain), blockHashes(new, grain)
+	changed = []
+	for block in grain.cover(union(old, new)):
+		if digest(old, oldHashes, block) != digest(new, newHashes, block):
+			if changed and changed[-1][1] == block[0]:
+				changed[-1][1] = block[1]
+			else:
+				changed.append(list(block))
+	return changed
+
+def changedBytes(ranges):
+	return sum(e - a for a, e in ranges)
+
+def summary(ranges, old, new, block=PAGE_SIZE): # e.g. '12288 of 1048576 bytes changed (1.2%) in 3 ranges'
+	old, new = segmentsOf(old), segmentsOf(new)
+	size = sum(e - a for a, e in blocks(block).cover(union(old, new)))
+	changed = changedBytes(ranges)
+	return '%d of %d bytes changed (%.1f%%) in %d range%s'%(changed, size,
+		100.0 * changed / size if size else 0, len(ranges), '' if len(ranges) == 1 else 's')
+
+if __name__ == '__main__':
+	import time, image
+	from message import *
+	from targets import sectors
+	args = [a for a in sys.argv[1:] if '=' not in a]
+	options = dict(a.split('=', 1) for a in sys.argv[1:] if '=' in a)
+	if len(args) != 2:
+		print __doc__
+		sys.exit(1)
+	block = options.get('block', str(PAGE_SIZE))
+	block = [(a, n * 1024) for s, a, n in sectors] if block == 'sector' else int(block, 0)
+	records = []
+	for file in args:
+		record = image.imageRecord(None)
+		record.follow = False
+		record.readFile(file)
+		records.append(record)
+	t = time.time()
+	ranges = diff(records[0], records[1], block)
+	t = time.time() - t
+	for a, e in ranges:
+		print '%08X-%08X %d'%(a, e, e - a)
+	note('%s; compared in %.3f seconds'%(summary(ranges, records[0], records[1], block), t))
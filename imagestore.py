@@ -0,0 +1,92 @@
+# process wide store of loaded images shared by the records holding them
+
+'''
+The same build is often loaded into several targets, and reloaded by each of
+them when it changes. Images are kept here by the hash of the file contents
+and the options they were loaded with, so a file is parsed and held once
+however many records use it. Records hold a reference to the stored image
+and share its segments; a record that changes its segments, as rebase does,
+gives its reference up first.
+
+References are weak so a record that is dropped, like one made by a loader
+thread or the file watcher, lets go of its image without being told. Images
+no record holds are kept, least recently used first out, until they add up to
+KEEP_SIZE bytes.
+'''
+import os, threading, weakref
+from collections import OrderedDict
+import imagecache
+
+printme = 0
+KEEP_SIZE = 32 * 1024 * 1024 # bytes of images no record holds kept for reuse
+HASHES = 256 # remembered content hashes
+
+class storedImage(object): # one loaded image and the records holding it
+	FIELDS = ['segments', 'start', 'end', 'entry', 'size', 'checksum', 'overlaps', 'versions']
+
+	def __init__(self, key, record):
+		self.key = key
+		for name in self.FIELDS:
+			setattr(self, name, getattr(record, name))
+		self.bytes = self.segments.size()
+		self.holders = weakref.WeakSet()
+
+lock = threading.RLock()
+images = OrderedDict() # key: storedImage; least recently used first
+hashes = {} # (path, mtime, size): content hash
+
+def contentHash(file): # hash of the file contents; hashed again only when it changes
+	stat = os.stat(file)
+	stamp = (os.path.abspath(file), stat.st_mtime, stat.st_size)
+	with lock:
+		digest = hashes.get(stamp)
+	if digest is None:
+		digest = imagecache.contentHash(file)
+		with lock:
+			if len(hashes) >= HASHES:
+				hashes.clear()
+			hashes[stamp] = digest
+	return digest
+
+def get(key, record): # stored image for key now held by record, or None
+	with lock:
+		image = images.pop(key, None)
+		if image is None:
+			return None
+		images[key] = image # most recently used
+		image.holders.add(record)
+		if printme: print 'image store hit: %d holders'%len(image.holders)
+		return image
+
+def put(key, record): # store the image record has loaded; record holds it
+	with lock:
+		image = images.pop(key, None) or storedImage(key, record)
+		images[key] = image
+		image.holders.add(record)
+		evict()
+		return image
+
+def hold(image, record):
+	with lock:
+		image.holders.add(record)
+
+def release(image, record):
+	with lock:
+		image.holders.discard(record)
+		evict()
+
+def evict(): # drop the least recently used images no record holds
+	with lock:
+		spare = sum(image.bytes for image in images.values() if not image.holders)
+		for key in list(images):
+			if spare <= KEEP_SIZE:
+				break
+			image = images[key]
+			if not image.holders:
+				spare -= image.bytes
+				del images[key]
+
+def clear():
+	with lock:
+		images.clear()
+		hashes.clear()
@@ -0,0 +1,101 @@
+# write images out as S-records, Intel hex or binary
+
+'''
+Lines are generated from a segment map as they are written so no output file
+is ever held in memory. Runs of fill (0xFF, erased flash) at least a record
+long are left out; holes between segments are never written. Records do not
+cross a 64K boundary so hex files need a type 04 record only when the upper
+address changes.
+'''
+import re, binascii
+
+RECORD_LENGTH = {'srec':32, 'hex':16} # default data bytes per record
+
+def hexRecord(type, address, data=''):
+	record = chr(len(data)) + chr(address >> 8 & 0xFF) + chr(address & 0xFF) + chr(type) + data
+	return ':%s%02X\n'%(binascii.hexlify(record).upper(), -sum(bytearray(record)) & 0xFF)
+
+def srecord(type, address, data=''):
+	n = {'0':2, '1':2, '2':3, '3':4, '5':2, '6':3, '7':4, '8':3, '9':2}[type] # address bytes
+	record = ''.join(chr(address >> (8*i) & 0xFF) for i in reversed(range(n))) + data
+	record = chr(len(record) + 1) + record
+	return 'S%s%s%02X\n'%(type, binascii.hexlify(record).upper(), ~sum(bytearray(record)) & 0xFF)
+
+def blocks(segments, start, end, fill=0xFF, run=32):
+	'''
+	(address, bytes) of the data between start and end leaving out runs of
+	fill of run bytes or more.
+	'''
+	skip = re.compile(re.escape(chr(fill)) + '{%d,}'%max(1, run))
+	for address, data, length in segments.walk(start, end):
+		if data is None:
+			continue
+		data = data.tobytes()
+		i = 0
+		for m in skip.finditer(data):
+			if m.start() > i:
+				yield address + i, data[i:m.start()]
+			i = m.end()
+		if i < len(data):
+			yield address + i, data[i:]
+
+def records(segments, start, end, length, fill=0xFF): # (address, data) records not crossing 64K
+	for address, data in blocks(segments, start, end, fill, length):
+		i = 0
+		while i < len(data):
+			a = address + i
+			n = min(length, len(data) - i, 0x10000 - (a & 0xFFFF))
+			yield a, data[i:i + n]
+			i += n
+
+def hexLines(segments, start, end, entry=None, length=16, fill=0xFF):
+	length = min(length, 0xFF)
+	upper = 0
+	for address, data in records(segments, start, end, length, fill):
+		if address >> 16 != upper:
+			upper = address >> 16
+			yield hexRecord(4, 0, chr(upper >> 8) + chr(upper & 0xFF))
+		yield hexRecord(0, address & 0xFFFF, data)
+	if entry:
+		yield hexRecord(5, 0, ''.join(chr(entry >> s & 0xFF) for s in (24, 16, 8, 0)))
+	yield hexRecord(1, 0)
+
+def srecordLines(segments, start, end, entry=None, length=32, fill=0xFF, header=''):
+	top = max(end - 1, entry or 0)
+	data, stop = ('1', '9') if top < 0x10000 else ('2', '8') if top < 0x1000000 else ('3', '7')
+	length = min(length, 0xFF - 1 - (int(data) + 1)) # count covers address, data and checksum
+	yield srecord('0', 0, header)
+	count = 0
+	for address, block in records(segments, start, end, length, fill):
+		yield srecord(data, address, block)
+		count += 1
+	if count < 0x10000:
+		yield srecord('5', count)
+	elif count < 0x1000000:
+		yield srecord('6', count)
+	yield srecord(stop, entry or 0)
+
+def binaryBlocks(segments, start, end): # everything from start to end with holes filled
+	for address, data, length in segments.walk(start, end):
+		yield data.tobytes() if data is not None else chr(segments.fill) * length
+
+def writeImage(segments, file, start, end, entry=None, length=None, fill=0xFF, header=''):
+	'''
+	Write segments from start to end to file in the format given by its
+	suffix: .srec or .S19 for S-records, .hex for Intel hex and .bin for a
+	binary from start with holes filled.
+	'''
+	ext = file.rsplit('.', 1)[-1]
+	if ext in ['srec', 'S19']:
+		lines = srecordLines(segments, start, end, entry, length or RECORD_LENGTH['srec'], fill, header)
+	elif ext == 'hex':
+		lines = hexLines(segments, start, end, entry, length or RECORD_LENGTH['hex'], fill)
+	elif ext == 'bin':
+		lines = binaryBlocks(segments, start, end)
+	else:
+		raise ValueError('Unknown format. File suffix not any of: .hex, .srec, .S19, .bin: %s'%file)
+	out = open(file, 'wb' if ext == 'bin' else 'w')
+	try:
+		out.writelines(lines)
+	finally:
+		out.close()
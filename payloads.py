@@ -0,0 +1,247 @@
+# SFP packet payloads declared once and compiled to encoders and decoders
+
+'''
+Each payload is declared as a list of (name, format) fields in struct format
+codes, big endian as packets are sent. Two formats are not struct codes:
+'counted' is a byte count followed by that many bytes, as names are sent,
+unicode ones as latin-1, and '*' is the rest of the packet, as data is sent;
+'*' must come last. Runs of fixed fields are compiled once to struct.Struct.
+
+Layout mistakes fail when the module is imported rather than when a packet
+arrives: an unknown format, a name used twice, '*' before the end, a fixed
+part larger than a packet or one that is not the length the target sends.
+
+Each payload keeps one buffer of MAX_PAYLOAD bytes that it is encoded into:
+fixed fields by Struct.pack_into and names and data by slice assignment
+through a memoryview, so nothing is allocated but the result. pack gives a
+bytearray copy of the payload and encode the list of byte values sendNPS
+takes. decode reads a packet in place, data through a memoryview, and gives
+a namedtuple, or None if the packet is too short. Payloads of fixed fields,
+with or without data after them, have codings of their own that are a
+single struct call.
+'''
+import struct
+from collections import namedtuple
+from endian import codec
+from message import *
+
+printme = 0
+MAX_PAYLOAD = 255 # bytes in the largest packet payload
+COUNTED, REST = 'counted', '*'
+
+class payload(object):
+	def __init__(self, name, fields, length=None):
+		self.name = name
+		names = [field for field, format in fields]
+		if len(set(names)) != len(names):
+			raise ValueError('%s: field named twice'%name)
+		if REST in [format for field, format in fields[:-1]]:
+			raise ValueError('%s: %s must be the last field'%(name, REST))
+		self.tuple = namedtuple(name, names)
+		self.buffer = bytearray(MAX_PAYLOAD) # encoded into; copied out by pack and encode
+		self.view = memoryview(self.buffer)
+		self.parts = [] # (struct, number of fields) for runs of fixed fields or (COUNTED or REST, 1)
+		run = []
+		for field, format in fields + [(None, None)]:
+			if format not in (COUNTED, REST, None):
+				run.append(format)
+				continue
+			if run:
+				self.parts.append((self.compile(run), len(run)))
+				run = []
+			if format:
+				self.parts.append((format, 1))
+		self.size = sum(1 if part == COUNTED else 0 if part == REST else part.size for part, n in self.parts)
+		if self.size > MAX_PAYLOAD:
+			raise ValueError('%s: %d bytes is more than a packet holds'%(name, self.size))
+		if length is not None and length != self.size:
+			raise ValueError('%s: fields take %d bytes but %d are sent'%(name, self.size, length))
+		# most payloads are fixed fields, perhaps followed by data; they get their own codings
+		head, n = self.parts[0]
+		if head in (COUNTED, REST):
+			return
+		self.head, self.fields = head, n
+		if len(self.parts) == 1:
+			self.fill, self.encode, self.decode = self.fillFixed, self.fixedEncoder(), self.decodeFixed
+		elif len(self.parts) == 2 and self.parts[1][0] == REST:
+			self.fill, self.encode, self.decode = self.fillRest, self.restEncoder(), self.decodeRest
+
+	def compile(self, formats): # one struct for a run of fixed fields
+		for format in formats:
+			try:
+				single = len(struct.unpack(format, '\0'*struct.calcsize(format))) == 1
+			except struct.error:
+				raise ValueError('%s: bad format %s'%(self.name, format))
+			if not single:
+				raise ValueError('%s: format %s is more than one field'%(self.name, format))
+		return codec(''.join(formats))
+
+	def make(self, values): # namedtuple without the length check of _make
+		return tuple.__new__(self.tuple, values)
+
+	def short(self, packet, needed):
+		error('%s payload is %d bytes; %d needed'%(self.name, len(packet), needed))
+		return None
+
+	def pack(self, *values): # bytearray of the payload
+		return bytearray(self.view[:self.fill(values)])
+
+	def encode(self, *values): # list of byte values for sendNPS
+		return self.view[:self.fill(values)].tolist()
+
+	def put(self, offset, data): # bytes into the buffer at offset; gives the offset after them
+		end = offset + len(data)
+		if end > MAX_PAYLOAD:
+			raise ValueError('%s: %d bytes is more than a packet holds'%(self.name, end))
+		try:
+			self.view[offset:end] = data
+		except TypeError: # a list of ints or no buffer interface
+			self.buffer[offset:end] = bytearray(data)
+		return end
+
+	# any layout
+	def fill(self, values): # values into the buffer; gives the length of the payload
+		offset = i = 0
+		for part, n in self.parts:
+			if part == COUNTED:
+				value = values[i]
+				if isinstance(value, unicode): # names from Qt file dialogs
+					value = value.encode('latin-1')
+				self.buffer[offset] = len(value)
+				offset = self.put(offset + 1, value)
+			elif part == REST:
+				offset = self.put(offset, values[i])
+			else:
+				part.pack_into(self.buffer, offset, *values[i:i + n])
+				offset += part.size
+			i += n
+		return offset
+
+	def decode(self, packet): # namedtuple of the fields or None if the packet is short
+		if isinstance(packet, list):
+			packet = bytearray(packet)
+		view = memoryview(packet)
+		values = []
+		offset = 0
+		for part, n in self.parts:
+			if part == COUNTED:
+				if offset >= len(packet):
+					return self.short(packet, offset + 1)
+				count = struct.unpack_from('B', packet, offset)[0]
+				if offset + 1 + count > len(packet):
+					return self.short(packet, offset + 1 + count)
+				values.append(view[offset + 1:offset + 1 + count].tobytes())
+				offset += 1 + count
+			elif part == REST:
+				values.append(view[offset:])
+			else:
+				if offset + part.size > len(packet):
+					return self.short(packet, offset + part.size)
+				values.extend(part.unpack_from(packet, offset))
+				offset += part.size
+		return self.make(values)
+
+	# fixed fields only
+	def fillFixed(self, values):
+		self.head.pack_into(self.buffer, 0, *values)
+		return self.size
+
+	def fixedEncoder(self): # encode with what it uses held in the closure rather than looked up
+		pack_into, buffer, view, size = self.head.pack_into, self.buffer, self.view, self.size
+		def encode(*values):
+			pack_into(buffer, 0, *values)
+			return view[:size].tolist()
+		return encode
+
+	def decodeFixed(self, packet):
+		if isinstance(packet, list):
+			packet = bytearray(packet)
+		try:
+			return self.make(self.head.unpack_from(packet))
+		except struct.error:
+			return self.short(packet, self.size)
+
+	# fixed fields then data
+	def fillRest(self, values):
+		self.head.pack_into(self.buffer, 0, *values[:self.fields])
+		return self.put(self.size, values[self.fields])
+
+	def restEncoder(self): # as fixedEncoder; every chunk of a send is encoded by one of these
+		pack_into, buffer, view, size, put = self.head.pack_into, self.buffer, self.view, self.size, self.put
+		def encode(*values):
+			data = values[-1]
+			end = size + len(data)
+			pack_into(buffer, 0, *values[:-1])
+			try:
+				view[size:end] = data
+			except (TypeError, ValueError): # a list of ints, no buffer interface or too long
+				put(size, data)
+			return view[:end].tolist()
+		return encode
+
+	def decodeRest(self, packet):
+		if isinstance(packet, list):
+			packet = bytearray(packet)
+		try:
+			return self.make(self.head.unpack_from(packet) + (memoryview(packet)[self.size:],))
+		except struct.error:
+			return self.short(packet, self.size)
+
+WHO = [('whoto', 'B'), ('whofrom', 'B')]
+
+# flash memory
+eraseMemory = payload('eraseMemory', WHO + [('start', 'L'), ('end', 'L')])
+eraseConfirm = payload('eraseConfirm', WHO + [('start', 'L'), ('end', 'L'), ('result', 'B')], length=11)
+flashWrite = payload('flashWrite', WHO + [('address', 'L'), ('length', 'B'), ('data', REST)])
+writeConfirm = payload('writeConfirm', WHO + [('address', 'L'), ('length', 'B'), ('result', 'B')])
+checkMemory = payload('checkMemory', WHO + [('address', 'L'), ('length', 'L')])
+memoryCheck = payload('memoryCheck', WHO + [('address', 'L'), ('length', 'L'), ('checksum', 'L')])
+
+# version and parameters
+getVersion = payload('getVersion', WHO)
+versionNumber = payload('versionNumber', WHO + [('major', 'B'), ('minor', 'B'), ('build', 'H'),
+	('reserved', 'B'), ('date', '20s'), ('name', COUNTED)])
+setParameter = payload('setParameter', WHO + [('parameter', 'L'), ('value', 'L')])
+getParameter = payload('getParameter', WHO + [('parameter', 'L')])
+parameter = payload('parameter', WHO + [('parameter', 'L'), ('value', 'L')])
+
+# file transfers; the spid follows who
+transferRequest = payload('transferRequest', WHO + [('spid', 'B'), ('size', 'L'), ('name', COUNTED), ('type', 'B')])
+transferData = payload('transferData', WHO + [('spid', 'B'), ('index', 'L'), ('data', REST)])
+transferDone = payload('transferDone', WHO + [('spid', 'B'), ('checksum', 'L')])
+transferReply = payload('transferReply', WHO + [('spid', 'B'), ('result', 'B')])
+
+if __name__ == '__main__': # compare with the lists they replace and time them
+	import timeit
+	from endian import longList, cast
+	data = bytearray(range(90))
+	who = [1, 2]
+	expected = who + longList(0x08001234) + [len(data)] + list(data)
+	for given in [data, list(data), str(data), memoryview(data)]:
+		assert flashWrite.encode(1, 2, 0x08001234, len(data), given) == expected
+	assert list(flashWrite.pack(1, 2, 0x08001234, len(data), data)) == expected
+	assert checkMemory.encode(1, 2, 0x08001234, 90) == who + longList(0x08001234) + longList(90)
+	assert transferRequest.encode(1, 2, 0, 1000, 'app.bin', 3) == who + [0] + longList(1000) + [7] + map(ord, 'app.bin') + [3]
+	assert transferRequest.encode(1, 2, 0, 1000, u'app\xe9.bin', 3) == who + [0] + longList(1000) + [8] + map(ord, 'app\xe9.bin') + [3]
+	try:
+		flashWrite.encode(1, 2, 0, 0, bytearray(MAX_PAYLOAD))
+		raise AssertionError('oversized payload encoded')
+	except ValueError:
+		pass
+	packet = who + longList(0x08001234) + [90, 0]
+	assert tuple(writeConfirm.decode(packet)) == cast('BBLBB', packet)
+	version = who + [1, 2, 0, 3, 0] + map(ord, 'Aug 23 2013 21:48:33'.ljust(20, '\0')) + [3] + map(ord, 'app')
+	assert versionNumber.decode(version).name == 'app' and versionNumber.decode(version[:-1]) is None
+	assert eraseConfirm.decode(who + [0]*9).result == 0
+	view = memoryview(data)
+	for name, old, new in [
+		('flashWrite', lambda: who + longList(0x08001234) + [len(view)] + view.tolist(),
+			lambda: flashWrite.encode(1, 2, 0x08001234, len(view), view)),
+		('checkMemory', lambda: who + longList(0x08001234) + longList(90),
+			lambda: checkMemory.encode(1, 2, 0x08001234, 90)),
+		('writeConfirm', lambda: cast('BBLBB', packet)[4], lambda: writeConfirm.decode(packet).result)]:
+		before = after = 1.0 # best of many short runs taken in turn, steadier than one long one
+		for i in range(200):
+			before = min(before, timeit.timeit(old, number=2000) / 2000)
+			after = min(after, timeit.timeit(new, number=2000) / 2000)
+		print '%-12s %.2fus -> %.2fus  %.1fx'%(name, 1e6*before, 1e6*after, before/after)
@@ -19,7 +19,7 @@ updateUi('mainWindow')
 from mainWindow import Ui_MainWindow
 import traceback
 
-import listports, serialio
+import listports, serialio, elfsymbols
 from message import *
 
 class terminal(QMainWindow):
@@ -68,6 +68,11 @@ class terminal(QMainWindow):
 		self.ui.ClearText.clicked.connect(self.clearText)
 		self.ui.saveText.clicked.connect(self.saveText)
 		self.textcount = 0
+		self.symbols = elfsymbols.symbolFilter() # addresses in target output get symbol names
+		self.symbolTimer = QTimer() # restarted by each read that leaves text held
+		self.symbolTimer.setSingleShot(True)
+		self.symbolTimer.setInterval(50)
+		self.symbolTimer.timeout.connect(self.flushSymbols)
 
 		# capture all qt errors to terminal window
 		def log_uncaught_exceptions(ex_cls, ex, tb):
@@ -369,13 +374,26 @@ class terminal(QMainWindow):
 				self.linebuffer.append(character)
 				self.write(character)
 
-	def write(self, s, style=''):
+	def write(self, s, style=''): # local echo; only received text is annotated
 		if style:
 			s = '\n'+s
-		self.sink(s)
+		self.flushSymbols() # held target text goes out ahead of the echo
+		if s:
+			message(s)
 
 	def sink(self, s):
-		message(s)	
+		if not self.ui.InHex.isChecked():
+			s = self.symbols.annotate(s)
+			if self.symbols.held:
+				self.symbolTimer.start()
+		if s:
+			message(s)
+
+	def flushSymbols(self): # text held at the end of a read; annotated if it was a whole address
+		self.symbolTimer.stop()
+		s = self.symbols.flush()
+		if s:
+			message(s)
 
 	def isCursorVisible(self):
 		vbar = self.ui.textEdit.verticalScrollBar()
@@ -9,6 +9,7 @@ from pyqtapi2 import *
 from protocols import pids
 from endian import *
 from message import *
+import payloads
 
 # parameter spids
 AUTOBOOT_PARAM = 1 # whether to autoboot (1) or not (0)
@@ -57,11 +58,9 @@ class recover(QObject):
 	def sendStopAutoboot(self):
 		if self.attempts:
 			self.attempts -= 1
-			who = [self.parent.whoto, self.parent.whofrom]
-			parameter1 = longList(AUTOBOOT_PARAM)
-			value1 = longList(0)
-			set = who + parameter1 + value1
-			get = who + parameter1
+			whoto, whofrom = self.parent.whoto, self.parent.whofrom
+			set = payloads.setParameter.encode(whoto, whofrom, AUTOBOOT_PARAM, 0)
+			get = payloads.getParameter.encode(whoto, whofrom, AUTOBOOT_PARAM)
 			self.protocol.sendNPS(pids.SET_PARAM, set)
 			self.protocol.sendNPS(pids.GET_PARAM, get)
 			note('\nsent stop autobooting.')
@@ -71,8 +70,8 @@ class recover(QObject):
 			self.failed.emit()
 
 	def readParam(self, packet):
-		[parameter, value] =  cast('BBLL', packet)[2:4]
-		if parameter == AUTOBOOT_PARAM and value == 0:
+		reply = payloads.parameter.decode(packet)
+		if reply and reply.parameter == AUTOBOOT_PARAM and reply.value == 0:
 			note('\nAutboot disabled.')
 			self.stopRecovery()
 			self.recovered.emit()
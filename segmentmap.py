@@ -0,0 +1,426 @@
+# sparse memory image made of address segments
+
+'''
+A firmware image seldom fills the address span it covers. A vector table at
+0x08000000 and data at 0x08100000 leave a megabyte hole which would otherwise
+be allocated and filled. A segment map keeps only the bytes that were given
+as a sorted list of (address, buffer) segments and supplies the fill value for
+holes when asked for a range.
+
+Segments never overlap. Adding data that touches or overlaps a segment merges
+them with the newest data winning. Views handed out are memoryviews into the
+segment buffers so nothing is copied unless a range spans a hole.
+
+Segments larger than SPILL_SIZE are kept in a memory mapped temporary file so
+images of tens of megabytes leave resident only the pages in use. Those are
+walked a page at a time and their views are copies of no more than a page.
+'''
+import os, bisect, mmap, tempfile
+from operator import itemgetter
+from checksum import checksumEngine
+
+PAGE_SIZE = 1024 * 1024 # most copied out of a mapped buffer at once
+SPILL_SIZE = 8 * 1024 * 1024 # larger segments are kept in a mapped file
+
+def view(buffer, start, end): # zero copy slice of a buffer as a memoryview
+	try:
+		return memoryview(buffer)[start:end]
+	except TypeError: # no buffer interface; copy the slice
+		return memoryview(bytearray(buffer[start:end]))
+
+def copy(target, offset, source): # copy source into target at offset a page at a time
+	for i in range(0, len(source), PAGE_SIZE):
+		n = min(PAGE_SIZE, len(source) - i)
+		target[offset + i:offset + i + n] = view(source, i, i + n)
+
+class mappedBuffer(object):
+	'''
+	Buffer held in a memory mapped temporary file. It supports what segmentMap
+	asks of a buffer: len, slicing, slice assignment and find, and it can be
+	grown in place. Slices are copies; there is no buffer interface to view
+	the map through.
+	'''
+	def __init__(self, size, fill=0xFF):
+		self.fill = fill
+		self.file = tempfile.TemporaryFile()
+		page = chr(fill) * min(size, PAGE_SIZE)
+		for i in range(0, size, PAGE_SIZE):
+			self.file.write(page[:size - i])
+		self.file.flush()
+		self.map = mmap.mmap(self.file.fileno(), size)
+
+	def grow(self, size): # lengthen to size bytes, the new ones fill; the file grows, nothing is copied
+		old = len(self.map)
+		self.map.resize(size)
+		page = chr(self.fill) * min(size - old, PAGE_SIZE)
+		for i in range(old, size, PAGE_SIZE):
+			self.map[i:min(size, i + PAGE_SIZE)] = page[:size - i]
+
+	def __len__(self):
+		return len(self.map)
+
+	def __getitem__(self, index):
+		return self.map[index]
+
+	def __setitem__(self, index, data):
+		if isinstance(data, memoryview):
+			data = data.tobytes()
+		elif not isinstance(data, str):
+			data = str(data)
+		self.map[index] = data
+
+	def find(self, sub, start=0, end=None):
+		return self.map.find(str(sub), start, len(self.map) if end is None else end)
+
+def recordSpans(records):
+	'''
+	Index (address, data) records as intervals without touching their bytes.
+	Returns the contiguous [start, end] spans they cover and the address
+	ranges covered by more than one record, both sorted and merged. A record
+	overlaps an earlier one when it starts below the furthest end seen so far
+	so one pass over the sorted records finds them all.
+	'''
+	spans, overlaps = [], []
+	for address, data in sorted(records, key=itemgetter(0)):
+		end = address + len(data)
+		if end == address:
+			continue
+		if spans and address <= spans[-1][1]:
+			if address < spans[-1][1]:
+				high = min(end, spans[-1][1])
+				if overlaps and address <= overlaps[-1][1]:
+					overlaps[-1][1] = max(overlaps[-1][1], high)
+				else:
+					overlaps.append([address, high])
+			spans[-1][1] = max(spans[-1][1], end)
+		else:
+			spans.append([address, end])
+	return spans, [tuple(o) for o in overlaps]
+
+class segmentMap(object):
+	def __init__(self, fill=0xFF, spill=None):
+		self.fill = fill
+		self.spill = SPILL_SIZE if spill is None else spill # segments over this size are mapped
+		self.addresses = [] # start address of each segment; sorted for bisect
+		self.buffers = []
+		self.flat = None # (start, end, buffer) of the last flatten
+
+	def __len__(self):
+		return len(self.buffers)
+
+	def __iter__(self): # (address, buffer) for each segment in address order
+		return iter(zip(self.addresses, self.buffers))
+
+	def start(self):
+		return self.addresses[0] if self.addresses else 0
+
+	def end(self):
+		return self.addresses[-1] + len(self.buffers[-1]) if self.addresses else 0
+
+	def size(self): # bytes held, holes excluded
+		return sum(map(len, self.buffers))
+
+	def segmentEnd(self, i):
+		return self.addresses[i] + len(self.buffers[i])
+
+	def allocate(self, size): # buffer of size bytes of fill
+		if size > self.spill:
+			return mappedBuffer(size, self.fill)
+		return bytearray([self.fill]) * size
+
+	def grow(self, i, end): # extend segment i with fill to end, in place where its buffer allows
+		buffer = self.buffers[i]
+		size = end - self.addresses[i]
+		if isinstance(buffer, mappedBuffer):
+			buffer.grow(size)
+			return
+		if isinstance(buffer, bytearray) and size <= self.spill:
+			try:
+				buffer.extend(bytearray([self.fill]) * (size - len(buffer)))
+				return
+			except BufferError: # buffer has views exported; copied below
+				pass
+		grown = self.allocate(size)
+		copy(grown, 0, buffer)
+		self.buffers[i] = grown
+
+	def load(self, address, file):
+		'''
+		Add the contents of a file as one segment. The bytes are copied into a
+		buffer of the map's own, a spill file if large, and the file is never
+		mapped: a rebuild rewriting it in place would truncate a mapping under
+		the image and the next read of it would kill the process.
+		'''
+		size = os.path.getsize(file)
+		if not size:
+			return False
+		with open(file, 'rb') as f:
+			if size <= self.spill:
+				data = bytearray(f.read())
+			else:
+				data = mappedBuffer(size, self.fill)
+				for i in range(0, size, PAGE_SIZE):
+					page = f.read(PAGE_SIZE)
+					data[i:i + len(page)] = page
+					if len(page) < PAGE_SIZE: # file cut short while reading
+						break
+		return self.add(address, data, merge=False)
+
+	def move(self, delta): # shift every segment by delta
+		self.addresses = [a + delta for a in self.addresses]
+		self.flat = None
+
+	def moved(self, delta): # copy shifted by delta; the buffers are shared, not copied
+		moved = segmentMap(self.fill, self.spill)
+		moved.addresses = [a + delta for a in self.addresses]
+		moved.buffers = list(self.buffers)
+		return moved
+
+	def add(self, address, data, merge=True):
+		'''
+		Add data at address. With merge, the data is copied and joined with any
+		segment it touches. Without merge the buffer is kept as given unless it
+		overlaps. Returns True if data already held was overwritten.
+		'''
+		if not len(data):
+			return False
+		self.flat = None
+		end = address + len(data)
+		first = bisect.bisect_right(self.addresses, address) - 1
+		if first < 0 or self.segmentEnd(first) < address + (0 if merge else 1):
+			first += 1
+		if merge:
+			last = bisect.bisect_right(self.addresses, end) - 1
+		else:
+			last = bisect.bisect_left(self.addresses, end) - 1
+
+		if first > last: # nothing nearby
+			if merge and len(data) <= self.spill:
+				data = bytearray(data)
+			elif merge:
+				buffer = self.allocate(len(data))
+				copy(buffer, 0, data)
+				data = buffer
+			self.addresses.insert(first, address)
+			self.buffers.insert(first, data)
+			return False
+
+		overlap = [i for i in range(first, last + 1)
+				   if self.addresses[i] < end and self.segmentEnd(i) > address] != []
+		if first == last and self.segmentEnd(first) == address and isinstance(self.buffers[first], bytearray):
+			try: # appending in address order is the common case
+				self.buffers[first].extend(data)
+				return False
+			except BufferError: # buffer has views exported; rebuild below
+				pass
+
+		low = min(address, self.addresses[first])
+		high = max(end, self.segmentEnd(last))
+		merged = self.allocate(high - low)
+		for i in range(first, last + 1):
+			copy(merged, self.addresses[i] - low, self.buffers[i])
+		copy(merged, address - low, data)
+		self.addresses[first:last + 1] = [low]
+		self.buffers[first:last + 1] = [merged]
+		return overlap
+
+	def addRecords(self, records, index=None):
+		'''
+		Add many (address, data) records at once. The spans from recordSpans,
+		or index if it was already made, make room first: a span is allocated
+		once, or the segment it follows is grown in place, or the segments it
+		touches are merged. Then every record is copied in with a slice
+		assignment in the order given, later records winning where they
+		overlap. Records may come in batches as a file is parsed; returns the
+		address ranges the batch overlaps, within itself or with data held.
+		'''
+		spans, overlaps = index or recordSpans(records)
+		overlaps = list(overlaps)
+		self.flat = None
+		for a, e in spans:
+			first = bisect.bisect_right(self.addresses, a) - 1
+			if first < 0 or self.segmentEnd(first) < a:
+				first += 1
+			last = bisect.bisect_right(self.addresses, e) - 1
+			for i in range(first, last + 1):
+				low, high = max(a, self.addresses[i]), min(e, self.segmentEnd(i))
+				if low < high:
+					overlaps.append((low, high))
+			if first > last: # nothing nearby
+				self.addresses.insert(first, a)
+				self.buffers.insert(first, self.allocate(e - a))
+			elif first == last and self.addresses[first] <= a: # runs on from a segment, as parsing in order does
+				if e > self.segmentEnd(first):
+					self.grow(first, e)
+			else:
+				low = min(a, self.addresses[first])
+				high = max(e, self.segmentEnd(last))
+				merged = self.allocate(high - low)
+				for i in range(first, last + 1):
+					copy(merged, self.addresses[i] - low, self.buffers[i])
+				self.addresses[first:last + 1] = [low]
+				self.buffers[first:last + 1] = [merged]
+		for address, data in records:
+			i = bisect.bisect_right(self.addresses, address) - 1
+			a = address - self.addresses[i]
+			self.buffers[i][a:a + len(data)] = data
+		return sorted(overlaps)
+
+	def walk(self, start=None, end=None):
+		'''
+		Cover start to end in address order yielding (address, view, length)
+		for data and (address, None, length) for holes. Mapped segments are
+		yielded a page at a time.
+		'''
+		if start is None: start = self.start()
+		if end is None: end = self.end()
+		address = start
+		i = max(0, bisect.bisect_right(self.addresses, start) - 1)
+		while address < end and i < len(self.addresses):
+			a = self.addresses[i]
+			e = self.segmentEnd(i)
+			if e <= address:
+				i += 1
+				continue
+			if a > address:
+				hole = min(a, end) - address
+				yield address, None, hole
+				address += hole
+				continue
+			stop = min(e, end)
+			if isinstance(self.buffers[i], mappedBuffer):
+				stop = min(stop, address + PAGE_SIZE)
+			yield address, view(self.buffers[i], address - a, stop - a), stop - address
+			address = stop
+			if stop == e:
+				i += 1
+		if address < end:
+			yield address, None, end - address
+
+	def range(self, start, end): # (address, view) of data between start and end
+		return [(a, v) for a, v, n in self.walk(start, end) if v is not None]
+
+	def extents(self, start=None, end=None): # (address, end) of data between start and end
+		if start is None: start = self.start()
+		if end is None: end = self.end()
+		for i in range(max(0, bisect.bisect_right(self.addresses, start) - 1), len(self.addresses)):
+			a, e = max(start, self.addresses[i]), min(end, self.segmentEnd(i))
+			if self.addresses[i] >= end:
+				break
+			if a < e:
+				yield a, e
+
+	def clip(self, start, end):
+		'''
+		(address, buffer) of data between start and end. Segments that lie
+		inside are given whole so they can be shared rather than copied.
+		'''
+		parts = []
+		for a, e in self.extents(start, end):
+			i = bisect.bisect_right(self.addresses, a) - 1
+			if a == self.addresses[i] and e == self.segmentEnd(i):
+				parts.append((a, self.buffers[i]))
+			else:
+				parts.extend((address, data) for address, data, n in self.walk(a, e))
+		return parts
+
+	def read(self, address, length): # memoryview of length bytes; copied only if it spans a hole
+		parts = list(self.walk(address, address + length))
+		if len(parts) == 1 and parts[0][1] is not None:
+			return parts[0][1]
+		return memoryview(self.assemble(address, address + length))
+
+	def flatten(self, start=None, end=None):
+		'''
+		Contiguous image from start to end with holes filled. A single segment
+		covering exactly that range is returned as is.
+		'''
+		if start is None: start = self.start()
+		if end is None: end = self.end()
+		if self.flat and self.flat[:2] == (start, end):
+			return self.flat[2]
+		i = bisect.bisect_right(self.addresses, start) - 1
+		if i >= 0 and self.addresses[i] == start and self.segmentEnd(i) == end \
+		   and isinstance(self.buffers[i], bytearray):
+			image = self.buffers[i]
+		else:
+			image = self.assemble(start, end)
+		self.flat = (start, end, image)
+		return image
+
+	def assemble(self, start, end): # new bytearray from start to end with holes filled
+		image = bytearray([self.fill]) * (end - start)
+		for address, data, length in self.walk(start, end):
+			if data is not None:
+				image[address - start:address - start + length] = data
+		return image
+
+	def find(self, sub, start=None, end=None): # address of sub within a segment or -1
+		for address, buffer in self:
+			a = 0 if start is None else max(0, start - address)
+			e = len(buffer) if end is None else min(len(buffer), end - address)
+			if a < e:
+				offset = buffer.find(sub, a, e)
+				if offset != -1:
+					return address + offset
+		return -1
+
+	def checksum(self, name, start=None, end=None):
+		'''
+		Checksum over a range with the engine named, as in checksum.py; holes
+		count as fill. Segment buffers are read in place through buffer
+		objects, which zlib takes where memoryviews are not.
+		'''
+		if start is None: start = self.start()
+		if end is None: end = self.end()
+		stream = checksumEngine(name)
+		address = start
+		for a, e in self.extents(start, end):
+			if address < a:
+				stream.fill(self.fill, a - address)
+			i = bisect.bisect_right(self.addresses, a) - 1
+			data = self.buffers[i]
+			data = data.map if isinstance(data, mappedBuffer) else data
+			try:
+				stream.update(buffer(data, a - self.addresses[i], e - a))
+			except TypeError: # a memoryview segment
+				stream.update(data[a - self.addresses[i]:e - self.addresses[i]])
+			address = e
+		if address < end:
+			stream.fill(self.fill, end - address)
+		return stream.digest()
+
+	def fletcher32(self, start=None, end=None):
+		return self.checksum('fletcher32', start, end)
+
+	def crc32(self, start=None, end=None):
+		return self.checksum('crc32', start, end)
+
+	def spans(self, start=None, end=None, align=1, gap=0):
+		'''
+		[start, end] spans to transfer to cover the data between start and end.
+		Spans start and end on align boundaries and holes of up to gap bytes
+		are covered with fill rather than skipped.
+		'''
+		if start is None: start = self.start()
+		if end is None: end = self.end()
+		spans = []
+		for address, stop in self.extents(start, end):
+			a = max(start, address - address % align)
+			e = min(end, -(-stop // align) * align)
+			if spans and a - spans[-1][1] <= gap:
+				spans[-1][1] = max(spans[-1][1], e)
+			else:
+				spans.append([a, e])
+		return spans
+
+	def pieces(self, size, start=None, end=None, align=1, gap=0):
+		'''
+		Split the spans between start and end into (address, view) pieces of
+		at most size bytes for transfer. Pieces are read as they are asked for.
+		'''
+		for a, e in self.spans(start, end, align, gap):
+			while a < e:
+				n = min(size, e - a)
+				yield a, self.read(a, n)
+				a += n
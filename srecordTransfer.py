@@ -6,12 +6,14 @@ slots: stopSending, startSending
 '''
 from pyqtapi2 import *
 
-import os
+import os, bisect
 from imageTransfer import imageTransfer
 from protocols import pids
 from endian import *
 from message import *
-from checksum import fletcher32
+from checksum import checksumEngine, checksumOf
+from segmentmap import segmentMap
+import imagewriter, payloads
 from targets import *
 from buildversion import *
 from cpuids import *
@@ -44,9 +46,12 @@ EVALUATE_PACKET_OVERHEAD = WHO_PACKET_OVERHEAD # pid, who
 MAX_WHO_PACKET_PAYLOAD = (MAX_PACKET_LENGTH - WHO_PACKET_OVERHEAD)
 MEMORY_PACKET_OVERHEAD = 4 + 1 # 32bit address + length
 maxMemTransfer = MAX_WHO_PACKET_PAYLOAD - MEMORY_PACKET_OVERHEAD
+MERGE_GAP = maxMemTransfer # a short hole costs less to send than starting another packet
 ALLOWABLE_GAP = 0x100 # maximum gap between image and header
 
 class sRecordTransfer(imageTransfer):
+	verifyChecksum = 'fletcher32' # engine in checksum.py the target checks memory with
+	headerChecksum = 'fletcher32' # and the one over the image header
 	starting = Signal()
 	aborted = Signal()
 	done = Signal() # signal for done
@@ -74,6 +79,7 @@ class sRecordTransfer(imageTransfer):
 		self.version = 0
 		# parameters passed
 		self.target = target
+		self.base = target # raw binaries load where they are sent
 		self.headerFlag = header
 		self.endian = endian
 		self.whofor = whofor
@@ -85,6 +91,9 @@ class sRecordTransfer(imageTransfer):
 
 		# srecord setup
 		self.sendState = IDLE
+		self.running = None # checksum of what the target has confirmed, in address order
+		self.streamed = 0 # address the running checksum has reached
+		self.checkpoints = {} # sector start: running checksum there
 		self.transferTimer = QTimer()
 		self.transferTimer.timeout.connect(self.sendAgain)
 
@@ -118,6 +127,16 @@ class sRecordTransfer(imageTransfer):
 	# set filename and directory
 	def useFile(self, file):
 		if printme: print >>sys.stderr, 'useFile'
+		if self.nameFile(file):
+			self.loadSrecord()
+
+	# same but parsed by a worker thread; done is signalled by imageLoaded
+	def loadFile(self, file):
+		if printme: print >>sys.stderr, 'loadFile'
+		if self.nameFile(file):
+			super(sRecordTransfer, self).loadFile(file)
+
+	def nameFile(self, file):
 		self.file = file
 		self.dir = ''
 		self.time = 0
@@ -129,7 +148,7 @@ class sRecordTransfer(imageTransfer):
 				self.dir, self.filename = x
 			else:
 				self.dir, self.filename = '', x[0]
-			self.loadSrecord()
+		return file
 
 	# load srecord as image
 	def getSrecord(self, file):
@@ -142,21 +161,36 @@ class sRecordTransfer(imageTransfer):
 			if printme: print >>sys.stderr, 'loadSrecord', self.endian
 			self.createImage(self.file)
 			self.appName, self.releaseDate, self.version = \
-			 extractNameDateVersion(self.image, self.endian)
+			 self.nameDateVersion(self.endian)
 		except Exception, e:
 			print >>sys.stderr, e
 			traceback.print_exc(file=sys.stderr)
 	
+	def adopt(self, record):
+		super(sRecordTransfer, self).adopt(record)
+		self.appName, self.releaseDate, self.version = \
+		 self.nameDateVersion(self.endian)
+
 	def checkLatest(self):
 		if printme: print >>sys.stderr, 'checkLatest'
 		if self.time != os.path.getmtime(self.file):
 			warning(' disk image is newer - reloading ')
 			t = self.target	# remember old addresses
 			s = self.start
+			self.time = os.path.getmtime(self.file)
+			old = self.segments
 			self.loadSrecord()
+			self.reportChanges(old)
 			if self.start == s: # assume same target address if srecord same start
 				self.target = t
 
+	# reloads from the file watcher wait until the target is idle
+	def busy(self):
+		return self.sendState != IDLE
+
+	def checkUpdates(self):
+		self.checkLatest()
+
 	def headersize(self): # adjust header size for srecord
 		if printme: print >>sys.stderr, 'headersize'
 		if self.headerFlag:
@@ -178,30 +212,59 @@ class sRecordTransfer(imageTransfer):
 			appName = self.appName
 			head = version + start + dest + size + entry + checksum \
 				    + headerSize + releaseDate + appName
-			headerChecksum = longList(fletcher32(head, HEADER_SIZE - 4), self.endian)
+			headerChecksum = longList(checksumOf(self.headerChecksum, head) & 0xFFFFFFFF, self.endian)
 			return head + headerChecksum
 		return []
 
+	def gap(self): # space between header and image when the image starts a little after it
+		gap = self.start - self.target - self.headersize()
+		return gap if gap <= ALLOWABLE_GAP else 0
+
+	def extent(self): # (start, end) of the target addresses written
+		return self.target, self.target + self.headersize() + max(self.gap(), 0) + self.size
+
+	def layout(self, download): # header and image at their target addresses
+		gap = self.gap()
+		offset = self.target + self.headersize() + max(gap, 0)
+		download.add(self.target, bytearray(self.header(gap)), merge=False)
+		for address, data in self.segments.clip(self.start, self.start + self.size):
+			download.add(offset + address - self.start, data, merge=False)
+
+	def prepare(self): # check the image can be sent and lay out the download
+		if self.loaders:
+			error('Image is still loading.')
+			return False
+		self.checkLatest()
+		if not self.segments: # image not loaded?
+			error('No srecord image loaded.')
+			return False
+		# download is laid out at target addresses; holes are erased flash and not sent
+		self.download = segmentMap(0xFF)
+		self.layout(self.download)
+		self.length = self.extent()[1] - self.target
+		self.extents = [(self.target, self.target + self.length)]
+		return True
+
+	def chunks(self): # pieces to write, each inside one of the extents erased
+		for start, end in self.extents:
+			for piece in self.download.pieces(maxMemTransfer, start, end, align=4, gap=MERGE_GAP):
+				yield piece
+
 	# srecord downloading
 	def fileOperation(self, operation):
 		try:
 			if printme: print >>sys.stderr, 'starting'
 			if self.sendState == IDLE:
 				self.whoto, self.whofrom = self.who()
-				self.checkLatest()
-				if not self.image: # image not loaded?
-					error('No srecord image loaded.')
+				self.running = None
+				if not self.prepare():
 					self.stopSending()
+					self.transferFinished.emit(False)
 					return
-
-				gap = (self.start - self.target - self.headersize())
-				if gap > ALLOWABLE_GAP:
-					gap = 0
-				filler = [0xff] * gap
-				header = self.header(gap)
-				self.download = header + filler + self.image[:self.size]
 				self.targetPointer = self.target
-				self.left = self.length = len(self.download)
+				self.erased = self.verified = 0 # extents done so far
+				self.left = self.total = sum([e - a for start, end in self.extents
+					for a, e in self.download.spans(start, end, align=4, gap=MERGE_GAP)])
 				self.startTransferTime = time.time()
 				self.progress.emit(0)
 				self.protocol.setHandler(pids.ERASE_CONF, self.eraseConfirmed)
@@ -249,8 +312,9 @@ class sRecordTransfer(imageTransfer):
 			self.left = 0
 			self.aborted.emit()
 		self.done.emit()
+		self.transferFinished.emit(False)
 
-	def gracefulExit(self):
+	def gracefulExit(self, verified=False):
 		if printme: print >>sys.stderr, 'graceful exit'
 		self.transferTimer.stop()
 		if self.sendState != IDLE:
@@ -261,6 +325,7 @@ class sRecordTransfer(imageTransfer):
 			self.download = 0
 			self.left = 0
 		self.done.emit()
+		self.transferFinished.emit(verified)
 
 	# send again
 	def sendAgain(self): # timeout occurred
@@ -284,16 +349,14 @@ class sRecordTransfer(imageTransfer):
 			self.transferTimer.stop()
 
 	# erasure
-	def erase(self): # erase a section of flash memory
+	def erase(self): # erase a section of flash memory; one for each extent
 		if printme: print >>sys.stderr, 'erase'
 		self.sendState = ERASE
-		end = self.targetPointer + self.left
-		note('Erasing flash - start: %X  end: %X ...'%(self.targetPointer,end))
+		start, end = self.extents[self.erased]
+		note('Erasing flash - start: %X  end: %X ...'%(start, end))
 		self.progress.emit(.5)
 		self.eraseStart.emit()
-		start = longList(self.targetPointer)
-		end = longList(end)
-		payload = [self.whoto, self.whofrom] + start + end
+		payload = payloads.eraseMemory.encode(self.whoto, self.whofrom, start, end)
 		self.protocol.sendNPS(pids.ERASE_MEM, payload)
 		
 	def ecPacketHandler(self, packet): # confirmed that memory has been erased
@@ -301,12 +364,20 @@ class sRecordTransfer(imageTransfer):
 		if self.sendState != ERASE:
 			self.stopSending()
 			return
-		result = cast('BBLLL', packet)[4]
+		reply = payloads.eraseConfirm.decode(packet)
+		if reply is None:
+			self.stopSending()
+			return
+		result = reply.result
 		if result:
 			message = memoryErrors.get(result) if result in memoryErrors else hex(result)
 			error('Flash erase failed %s'%message)
 			self.eraseFail.emit()
 			self.stopSending()
+		elif self.erased + 1 < len(self.extents):
+			self.erased += 1
+			self.retries = 5
+			self.erase()
 		else:
 			self.progress.emit(1)
 			self.eraseDone.emit()
@@ -320,8 +391,14 @@ class sRecordTransfer(imageTransfer):
 		if printme: print >>sys.stderr, 'transfer'
 		note('Transferring Image...')
 		self.sendState = TRANSFER
-		self.imagePointer = 0
-		self.chunk = 0
+		self.pieces = self.chunks() # read as sent
+		self.piece = next(self.pieces)
+		self.running = checksumEngine(self.verifyChecksum)
+		self.streamed = self.target
+		self.checkpoints = {self.target: self.running.copy()}
+		end = self.target + self.length
+		edges = set(address for sector, address, size in sectors) | set(sum(self.extents, ()))
+		self.boundaries = sorted(address for address in edges if self.target < address < end) + [end]
 		self.progress.emit(0)
 		self.transferStart.emit()
 		self.sendChunk()
@@ -332,18 +409,12 @@ class sRecordTransfer(imageTransfer):
 			self.stopSending()
 			return
 		self.transferTimer.start()
-		n = float(self.length - self.left)/self.length
+		n = float(self.total - self.left)/self.total
 		if printme: print >>sys.stderr, self.left
 		self.progress.emit(n)
-		if self.left >= maxMemTransfer:
-			self.sent = maxMemTransfer
-		else:
-			self.sent = self.left
-		who = [self.whoto, self.whofrom]
-		address = longList(self.targetPointer)
-		length = [self.sent]
-		data = self.download[self.imagePointer:self.imagePointer+self.sent]
-		payload = who+address+length+data
+		self.targetPointer, data = self.piece
+		self.sent = len(data)
+		payload = payloads.flashWrite.encode(self.whoto, self.whofrom, self.targetPointer, self.sent, data)
 		self.protocol.sendNPS(pids.FLASH_WRITE, payload)
 
 	def tcPacketHandler(self, packet):
@@ -351,7 +422,10 @@ class sRecordTransfer(imageTransfer):
 		if self.sendState != TRANSFER:
 			self.stopSending()
 			return
-		result = cast('BBLBB', packet)[4]
+		reply = payloads.writeConfirm.decode(packet)
+		if reply is None:
+			return # sent again on time out
+		result = reply.result
 		if result:
 			message = memoryErrors.get(result) if result in memoryErrors else hex(result)
 			error('Memory write failed: %s at address: %X'%(message, self.targetPointer))
@@ -359,27 +433,58 @@ class sRecordTransfer(imageTransfer):
 #			self.stopSending()
 		else:
 			self.retries = 5
-			self.chunk += 1
+			address, data = self.piece
+			self.advance(address)
+			self.advance(address + len(data), data)
+			self.piece = next(self.pieces, None)
 			self.left -= self.sent
-			self.targetPointer += self.sent
-			self.imagePointer += self.sent
 			if self.left:
 				self.sendChunk()
 			else:
+				self.advance(self.target + self.length) # erased flash after the last piece
 				self.transferDone.emit()
 				self.transferTimer.setInterval(4000)
 				self.transferTimer.start()
 				self.verify()
 
+	def advance(self, end, data=None):
+		'''
+		Carry the running checksum on to end over data, the bytes from where it
+		is up to end, or over erased flash if there is none. Its state is kept
+		at each sector start it passes.
+		'''
+		offset = 0
+		while self.streamed < end:
+			i = bisect.bisect_right(self.boundaries, self.streamed)
+			stop = min(end, self.boundaries[i]) if i < len(self.boundaries) else end
+			if data is None:
+				self.running.fill(self.download.fill, stop - self.streamed)
+			else:
+				self.running.update(data[offset:offset + stop - self.streamed])
+				offset += stop - self.streamed
+			self.streamed = stop
+			if i < len(self.boundaries) and stop == self.boundaries[i]:
+				self.checkpoints[stop] = self.running.copy()
+
+	def rangeChecksum(self, start, end): # from checkpoints when the engine allows
+		if self.running and end in self.checkpoints:
+			if start == self.target:
+				return self.checkpoints[end].digest()
+			if start in self.checkpoints and hasattr(self.running, 'since'):
+				return self.checkpoints[end].since(self.checkpoints[start])
+		download = self.download
+		if not download: # let go when the send ended; laid out again as it was sent
+			download = segmentMap(0xFF)
+			self.layout(download)
+		return download.checksum(self.verifyChecksum, start, end)
+
 	# verifying
-	def verify(self):
+	def verify(self): # one check for each extent
 		if printme: print >>sys.stderr, 'verify'
 		note('Verifying...')
 		self.sendState = VERIFY
-		who = [self.whoto, self.whofrom]
-		address = longList(self.target)
-		length = longList(len(self.download))
-		payload = who+address+length
+		start, end = self.extents[self.verified]
+		payload = payloads.checkMemory.encode(self.whoto, self.whofrom, start, end - start)
 		self.protocol.sendNPS(pids.CHECK_MEM, payload)
 		self.progress.emit(0)
 		self.progress.emit(.50)
@@ -390,9 +495,19 @@ class sRecordTransfer(imageTransfer):
 		if self.sendState != VERIFY:
 			self.stopSending()
 			return
-		targetCheckSum = cast('BBLLL', packet)[4]
-		hostCheckSum = fletcher32(self.download, len(self.download))
-		if targetCheckSum == hostCheckSum:
+		reply = payloads.memoryCheck.decode(packet)
+		if reply is None:
+			self.stopSending()
+			return
+		targetCheckSum = reply.checksum
+		hostCheckSum = self.rangeChecksum(*self.extents[self.verified])
+		verified = targetCheckSum == hostCheckSum
+		if verified and self.verified + 1 < len(self.extents):
+			self.verified += 1
+			self.retries = 5
+			self.verify()
+			return
+		if verified:
 			self.progress.emit(1)
 			self.verifyDone.emit()
 			note('Verified.\n')
@@ -401,39 +516,131 @@ class sRecordTransfer(imageTransfer):
 			error('Target image is different.')
 			self.verifyFail.emit()
 		self.sendState = STOPPING
-		self.gracefulExit()
+		self.gracefulExit(verified)
 
 	def transferStats(self):
 		if printme: print >>sys.stderr, 'transferStats'
 		if self.left == 0:
 			elapsed = time.time() - self.startTransferTime
 			transferMsg = 'Finished in %.1f seconds'%elapsed
-			rate = (8*len(self.download))/(elapsed*1000)
+			rate = (8*self.length)/(elapsed*1000)
 			rateMsg = ' @ %.1fkbps'%rate
 			note(transferMsg+rateMsg)
 
+class compositeTransfer(sRecordTransfer):
+	'''
+	Several targets merged into one image and sent as one: one pass of
+	erases, one write pass and one pass of verifies. Each part is laid out,
+	erased and verified over just the extent it would have sent alone, header
+	included, so the flash ends up the same as sending them in turn and flash
+	between parts is left alone. Parts without a file are left out; parts
+	that would overlap or that are routed to different targets are refused.
+	'''
+	def __init__(self, parent, parts, whofor=0, endian='big'):
+		self.parts = parts
+		super(compositeTransfer, self).__init__(parent, '', 0, 0, whofor, endian)
+
+	def loaded(self): # parts with files in target address order
+		return sorted([part for part in self.parts if part.file], key=lambda part: part.target)
+
+	def refresh(self): # values shown for the merged image
+		parts = self.loaded()
+		self.filename = ' + '.join(part.filename for part in parts)
+		self.target = self.start = parts[0].target if parts else 0
+		self.size = parts[-1].extent()[1] - self.start if parts else 0
+		self.entry = self.checksum = 0
+
+	def who(self): # the parts' own routing; prepare refuses parts routed apart
+		parts = self.loaded()
+		return parts[0].who() if parts else sRecordTransfer.who(self)
+
+	def checkLatest(self):
+		for part in self.loaded():
+			part.checkLatest()
+
+	def layout(self, download): # each part as it would be sent alone
+		for part in self.loaded():
+			part.layout(download)
+
+	def prepare(self):
+		parts = self.loaded()
+		if not parts:
+			error('No images to merge.')
+			return False
+		for part in parts[1:]:
+			if part.who() != parts[0].who():
+				error('%s and %s are for different targets; send them separately.'%(parts[0].filename, part.filename))
+				return False
+		for part in parts:
+			if not part.prepare():
+				error('%s not merged.'%part.filename)
+				return False
+		for low, high in zip(parts, parts[1:]):
+			if low.target + low.length > high.target:
+				error('%s overlaps %s at %X-%X'%(low.filename, high.filename, high.target, low.target + low.length))
+				return False
+		self.download = segmentMap(0xFF)
+		for part in parts:
+			for address, data in part.download:
+				self.download.add(address, data, merge=False)
+			part.download = 0
+		self.target = parts[0].target
+		self.length = parts[-1].target + parts[-1].length - self.target
+		self.extents = [(part.target, part.target + part.length) for part in parts]
+		return True
+
+	def writeImage(self, file, length=None): # the merged image as it would be flashed
+		if self.prepare():
+			imagewriter.writeImage(self.download, file, self.target, self.target + self.length,
+				None, length, self.HOLE_FILL)
+			self.download = 0
+
 class ubootTransfer(sRecordTransfer):
-	MAX_IMAGE_SIZE = 1024 * 1024 # 1MB
+	MAX_IMAGE_SIZE = 64 * 1024 * 1024 # 64MB
 	HOLE_FILL = 0xFF
+	uimage = None # header of a loaded uImage
 
 	def getSrecord(self, file):
 		if printme: print >>sys.stderr, 'getImage'
 		note('loading image: %s'%file)
 		self.useFile(file) # calls loadSrecord
 
+	def loadFile(self, file): # a binary is read rather than parsed
+		self.useFile(file)
+
 	def loadSrecord(self):
 		if printme: print >>sys.stderr, 'loadImage'
 		try:
-			self.image = map(ord, open(self.file, 'rb').read())
-			self.size = len(self.image)
-			self.checksum = fletcher32(self.image, self.size)
-			date = extractUbootDate(self.image)
+			self.emptyImage()
+			if os.path.getsize(self.file) > self.MAX_IMAGE_SIZE:
+				error('Image is too large! %d'%os.path.getsize(self.file))
+				self.size = self.checksum = 0
+				return
+			self.segments.load(0, self.file) # a copy; a rebuild rewriting the file cannot change it
+			self.uimage = uimageHead(self.segments.read(0, UIMAGE_HEADER_SIZE)) if self.segments else None
+			if self.uimage: # checked before anything is erased
+				try:
+					self.uimage = checkUimage(self.segments)
+				except uimageError, e:
+					error('%s: %s. Image rejected.'%(self.file, e))
+					self.emptyImage()
+					self.size = self.checksum = 0
+					return
+				date = extractUimageDate(self.segments.read(0, UIMAGE_HEADER_SIZE))
+				name = self.uimage.ih_name.rstrip('\0')[:APP_NAME_LENGTH] or uimageTag
+			else:
+				date = extractUbootDate(self.segments.buffers[0] if self.segments else bytearray())
+				name = ubootTag
+			self.size = self.segments.size()
+			self.checksum = self.segments.fletcher32(0, self.size)
 			self.version = buildVersion(date)
 			self.releaseDate = [0]*RELEASE_DATE_LENGTH
 			self.releaseDate[:len(date)] = map(ord, date)
 			self.appName = [0]*APP_NAME_LENGTH
-			self.appName[:len(ubootTag)] = map(ord, ubootTag)
+			self.appName[:len(name)] = map(ord, name)
 			if printme: print >>sys.stderr, self.size, self.checksum
+			self.watchFile()
+			self.imageLoaded.emit()
 		except Exception, e:
 			print >>sys.stderr, e
 			traceback.print_exc(file=sys.stderr)
@@ -6,6 +6,7 @@ import sys, traceback
 from endian import *
 from message import *
 from imageTransfer import imageTransfer
+from checksum import checksumOf
 
 printme = 0
 
@@ -93,16 +94,18 @@ class stmSender(imageTransfer):
 		message(' flash erased in %.1f seconds'%elapsed,'note')
 
 		note('Download image ')
-		self.pointer = self.start
-		self.writeCommand()
 		self.chunk = 256
+		self.sent = 0
+		self.pieces = self.segments.pieces(self.chunk, self.start, self.start + self.size, align=4)
+		self.writeCommand()
 
-	def writeCommand(self): # progress bar from .1 to .9
+	def writeCommand(self): # progress bar from .1 to .9; holes in the image are skipped
 		self.transferTimer.start(2000)
-		self.setProgress.emit(.1 + (.8*(self.pointer - self.start)/self.size))
-		if self.pointer < self.end:
+		self.setProgress.emit(.1 + (.8*self.sent/self.size))
+		try:
+			self.pointer, self.data = next(self.pieces)
 			self.onAck(self.checked(0x31), self.writeAddress)
-		else:
+		except StopIteration:
 			self.verifyBoot()
 
 	def writeAddress(self):
@@ -112,14 +115,12 @@ class stmSender(imageTransfer):
 	def writeData(self):
 		if not self.verbose:
 			message('.', "note")
-		self.chunk = min(self.chunk, self.end - self.pointer)
-		if self.chunk % 4:
-			error('Transfer size not a multiple of 4: %d'%self.chunk)
+		data = self.data.tolist()
+		if len(data) % 4:
+			error('Transfer size not a multiple of 4: %d'%len(data))
 			note('Image size: %d'%self.size)
-		index = self.pointer - self.start
-		self.pointer += self.chunk
-		data = self.image[index:index+self.chunk]
-		self.onAck(self.checksummed([self.chunk-1] + data), self.writeCommand)
+		self.sent += len(data)
+		self.onAck(self.checksummed([len(data)-1] + data), self.writeCommand)
 
 	def verifyBoot(self): # not verified, just trusted
 		# note('\nverify image')
@@ -169,7 +170,7 @@ class stmSender(imageTransfer):
 			traceback.print_exc(file=sys.stderr)
 
 	def checksummed(self, bytes):
-		bytes.append(reduce(lambda a,b: a^b, bytes))
+		bytes.append(checksumOf('xor8', bytes))
 		return bytes
 	
 	def checked(self, byte):
@@ -7,6 +7,33 @@ MAIN_BOOT		= 0x08000000
 MAIN_APP_LEFT	= 0x08040000
 MAIN_APP_RIGHT	= 0x08080000
 
+# STM32F4 flash sectors in KB
+#, sector, address,, size
+sectors = [[0, 0x08000000, 16],
+			[1, 0x08004000, 16],
+			[2, 0x08008000, 16],
+			[3, 0x0800C000, 16],
+			[4, 0x08010000, 64],
+			[5, 0x08020000, 128],
+			[6, 0x08040000, 128],
+			[7, 0x08060000, 128],
+			[8, 0x08080000, 128],
+			[9, 0x080A0000, 128],
+			[10, 0x080C0000, 128],
+			[11, 0x080E0000, 128],
+			[12, 0x08100000, 16],
+			[13, 0x08104000, 16],
+			[14, 0x08108000, 16],
+			[15, 0x0810C000, 16],
+			[16, 0x08110000, 64],
+			[17, 0x08120000, 128],
+			[18, 0x08140000, 128],
+			[19, 0x08160000, 128],
+			[20, 0x08180000, 128],
+			[21, 0x081A0000, 128],
+			[22, 0x081C0000, 128],
+			[23, 0x081E0000, 128]]
+
 '''
 #define RELEASE_DATE_LENGTH 32
 #define APP_NAME_LENGTH 16
@@ -4,12 +4,12 @@ from pyqtapi2 import *
 from message import *
 from protocols import pids
 from endian import *
-from srecordTransfer import sRecordTransfer, ubootTransfer
+from srecordTransfer import sRecordTransfer, compositeTransfer, ubootTransfer
 from recover import recover
-import led
+import led, bundle, payloads
 from cpuids import *
 from targets import *
-import sys
+import sys, os
 
 printme = 0
 SEND,TRANSFER,VERIFY = range(3)
@@ -29,6 +29,8 @@ class srecordPane(QWidget):
 		self.vled = led.LED(self.ui.verifyLed)
 		self.clearLeds()
 		self.lastTarget = None
+		self.bundle = [] # (item, transfer) for each item of a loaded firmware bundle
+		self.batch = None # bundle steps being sent
 
 		# default target addresses and menu setup
 			# name, transferObject(parent, filename, target address, header choice, who for)
@@ -37,6 +39,10 @@ class srecordPane(QWidget):
 			['Main App L',	sRecordTransfer(parent, '', MAIN_APP_LEFT,	1, MAIN_CPU, 'little')],
 			['Main App R',	sRecordTransfer(parent, '', MAIN_APP_RIGHT,	1, MAIN_CPU, 'little')]
 			]
+		# all of the above in one erase, write and verify
+		parts = [entry[1] for entry in self.targets]
+		self.allParts = parts # restored when a bundle is cleared
+		self.targets.append(['Main All', compositeTransfer(parent, parts, MAIN_CPU, 'little')])
 		for entry in self.targets:
 			self.ui.targetSelect.addItem(entry[0])
 			entry[1].progress.connect(self.progress)
@@ -53,6 +59,8 @@ class srecordPane(QWidget):
 			entry[1].starting.connect(self.eled.off)
 			entry[1].starting.connect(self.tled.off)
 			entry[1].starting.connect(self.vled.off)
+			entry[1].imageLoaded.connect(self.imageReloaded)
+			entry[1].loadProgress.connect(self.progress)
 
 		self.ui.targetSelect.setCurrentIndex(0)
 		self.showSrecordValues()
@@ -98,21 +106,37 @@ class srecordPane(QWidget):
 		if printme: print >>sys.stderr, 'showSrecordValues'
 		target = self.target()
 		self.lastTarget = target
+		self.showImageValues(target)
+		self.ui.targetAddress.setText(hex(target.target))
+		self.ui.header.setChecked(target.headerFlag)
+		self.ui.endian.setChecked(target.endian == 'big')
+	
+	def showImageValues(self, target): # values taken from the file
+		if isinstance(target, compositeTransfer):
+			target.refresh()
 		self.ui.srecordFile.setText(target.filename)
 		self.ui.addressStart.setText(hex(target.start))
-		self.ui.targetAddress.setText(hex(target.target))
 		self.ui.size.setText(str(target.size))
 		self.ui.entryPoint.setText(hex(target.entry))
 		self.ui.checkSum.setText("0x%X"%target.checksum) # prevent L suffix
-		self.ui.header.setChecked(target.headerFlag)
-		self.ui.endian.setChecked(target.endian == 'big')
-	
+
+	def imageReloaded(self): # file loaded or changed on disk; leave edited target values alone
+		if printme: print >>sys.stderr, 'imageReloaded'
+		self.parent.symbols.use([entry[1].file for entry in self.targets if entry[1].file])
+		if self.lastTarget is self.target():
+			self.showImageValues(self.lastTarget)
+		if not self.sending:
+			self.ui.progressBar.reset()
+
 	def saveSrecordValues(self): # this saves values to last target and shows current
 		if printme: print >>sys.stderr, 'saveSrecordValues'
 		if self.lastTarget:
 			target = self.lastTarget
 			target.filename = self.ui.srecordFile.text()
-			target.start = int(self.ui.addressStart.text(), 0)
+			start = int(self.ui.addressStart.text(), 0)
+			if target.ext == 'bin' and start != target.start: # a raw binary goes where it is told
+				target.rebase(start)
+			target.start = start
 			target.target = ~1 & int(self.ui.targetAddress.text(), 0) # keep even
 			target.size = ~1 & (1 + int(self.ui.size.text(), 0) ) # keep even
 			target.entry = int(self.ui.entryPoint.text(), 0)
@@ -135,14 +159,84 @@ class srecordPane(QWidget):
 		if printme: print >>sys.stderr, 'selectFile'
 		try:
 			target = self.target()
+			if isinstance(target, compositeTransfer): # a bundle holds the files for all targets
+				file = QFileDialog().getOpenFileName(directory=target.dir, filter='Bundles (*.zip)')
+				if file:
+					self.loadBundle(file)
+				self.showSrecordValues()
+				return
 			file = QFileDialog().getOpenFileName(directory=target.dir)
 			if file:
-				target.useFile(file)
+				self.clearBundle()
+				target.loadFile(file) # values are shown when loaded
 			self.showSrecordValues()
 		except Exception, e:
 			print >>sys.stderr, e
 			traceback.print_exc(file=sys.stderr)
 		
+	# firmware bundles
+	def loadBundle(self, file): # flash targets, eeprom script and jam file from one archive
+		self.clearBundle()
+		try:
+			firmware = bundle.firmwareBundle(file)
+			paths = firmware.extract()
+			firmware.close()
+		except bundle.bundleError, e:
+			error(str(e))
+			return
+		composite = self.target()
+		composite.dir = os.path.dirname(file)
+		flash = [entry for entry in self.targets if entry[1] is not composite]
+		utility = self.parent.utilityPane
+		loaded, parts = [], []
+		for item in firmware.items:
+			kind = item.get('kind', 'srecord')
+			if kind == 'srecord': # by name or else by target address
+				address = bundle.number(item['target'])
+				matches = [t for name, t in flash if name == item.get('name')] or \
+						  [t for name, t in flash if t.target == address]
+				if not matches:
+					error('No target for %s at %X'%(item['file'], address))
+					return
+				transfer = matches[0]
+				transfer.target = transfer.base = address
+				transfer.headerFlag = item.get('header', transfer.headerFlag)
+				transfer.endian = item.get('endian', transfer.endian)
+				transfer.whofor = item.get('whofor', transfer.whofor)
+				parts.append(transfer)
+			else:
+				transfer = utility.eeprom if kind == 'eeprom' else utility.jam
+			loaded.append((item, transfer))
+		for part in parts[1:]: # one composite send goes to one target
+			if part.who() != parts[0].who():
+				error('Bundle flashes more than one target: %s'%', '.join(sorted(set(str(part.who()[0]) for part in parts))))
+				return
+		for (item, transfer), path in zip(loaded, paths): # checked against the manifest when sent
+			transfer.loadFile(path)
+		composite.parts = parts # only what the bundle holds is flashed
+		self.bundle = loaded
+		note('Bundle %s: %s'%(os.path.basename(file), ', '.join(item['file'] for item in firmware.items)))
+
+	def clearBundle(self): # Main All goes back to every flash target
+		self.bundle = []
+		self.targets[-1][1].parts = list(self.allParts)
+
+	def sendBundle(self): # every checksum is checked before anything is sent
+		if not all([bundle.check(item, transfer) for item, transfer in self.bundle]):
+			return False
+		self.batch = bundle.batchFlash()
+		self.batch.finished.connect(self.bundleDone)
+		composite = self.target()
+		if composite.parts:
+			self.batch.add('flash', composite, composite.startSending)
+		for item, transfer in self.bundle:
+			if item.get('kind') == 'eeprom':
+				self.batch.add(item['file'], transfer, transfer.sendFile)
+			elif item.get('kind') == 'jam':
+				self.batch.add(item['file'], transfer, transfer.sendJam)
+		self.batch.start()
+		return True
+
 	def progress(self, n):
 		if printme: print >>sys.stderr, 'progress'
 		if n:
@@ -151,8 +245,15 @@ class srecordPane(QWidget):
 			self.ui.progressBar.reset()
 			self.ui.progressBar.setMaximum(1000)
 
+	def bundleDone(self, ok):
+		if printme: print >>sys.stderr, 'bundleDone'
+		self.batch = None
+		self.srecordDone()
+
 	def srecordDone(self):
 		if printme: print >>sys.stderr, 'srecordDone'
+		if self.batch: # the flash step of a bundle; eeprom and jam steps follow
+			return
 		self.sending = 0
 		self.ui.sendSrecord.setText('Send')
 		self.ui.progressBar.reset()
@@ -162,18 +263,12 @@ class srecordPane(QWidget):
 		if printme: print >>sys.stderr, 'getVersion'
 
 		def version(packet):
-			payload = cast('BBHB20sB', packet[2:28])
-			major = payload[0]
-			minor = payload[1]
-			build = payload[2]
-			date = payload[4]
-			n = payload[5]
-			name = cast('%ds'%n, packet[28:28+n])[0]
-			note('\n%s  %d.%d.%X  %s'%(name, major, minor, build, date))
-
-		who = [self.parent.whoto, self.parent.whofrom]
+			reply = payloads.versionNumber.decode(packet)
+			if reply:
+				note('\n%s  %d.%d.%X  %s'%(reply.name, reply.major, reply.minor, reply.build, reply.date))
+
 		self.protocol.setHandler(pids.VERSION_NO, version)
-		self.protocol.sendNPS(pids.GET_VERSION, who)
+		self.protocol.sendNPS(pids.GET_VERSION, payloads.getVersion.encode(self.parent.whoto, self.parent.whofrom))
 	
 	# recover
 	def selectRecover(self):
@@ -209,13 +304,16 @@ class srecordPane(QWidget):
 		if printme: print >>sys.stderr, command
 		if self.sending == 0:
 			target = self.target()
-			if not target.file:
+			if not target.file and not isinstance(target, compositeTransfer):
 				self.selectFile()
 				if not target.file:
 					print >>sys.stderr, 'no target file'
 					return
 			self.saveSrecordValues()
-			if command == SEND:
+			if command == SEND and self.bundle and isinstance(target, compositeTransfer):
+				if not self.sendBundle():
+					return
+			elif command == SEND:
 				target.startSending()
 			elif command == VERIFY:
 				target.startVerify()
@@ -54,8 +54,8 @@ class timbreTalk(qterm.terminal):
 		self.protocol = sfpQt()
 		self.whoto = self.whofrom = 0
 		self.serialPane = serialPane.serialPane(self)
-		transferPane.srecordPane(self)
-		utilitypane.utilityPane(self)
+		self.transferPane = transferPane.srecordPane(self)
+		self.utilityPane = utilitypane.utilityPane(self)
 		infopane.infoPane(self)
 		self.listRoutes()
 
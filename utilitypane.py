@@ -15,32 +15,6 @@ current_milli_time = lambda: int(round(time.time() * 1000))
 
 printme = 0
 
-#, sector, address,, size
-sectors = [[0, 0x08000000, 16],
-			[1, 0x08004000, 16],
-			[2, 0x08008000, 16],
-			[3, 0x0800C000, 16],
-			[4, 0x08010000, 64],
-			[5, 0x08020000, 128],
-			[6, 0x08040000, 128],
-			[7, 0x08060000, 128],
-			[8, 0x08080000, 128],
-			[9, 0x080A0000, 128],
-			[10, 0x080C0000, 128],
-			[11, 0x080E0000, 128],
-			[12, 0x08100000, 16],
-			[13, 0x08104000, 16],
-			[14, 0x08108000, 16],
-			[15, 0x0810C000, 16],
-			[16, 0x08110000, 64],
-			[17, 0x08120000, 128],
-			[18, 0x08140000, 128],
-			[19, 0x08160000, 128],
-			[20, 0x08180000, 128],
-			[21, 0x081A0000, 128],
-			[22, 0x081C0000, 128],
-			[23, 0x081E0000, 128]]
-
 class utilityPane(QWidget):
 	def __init__(self, parent):
 		QWidget.__init__(self, parent)
@@ -55,11 +29,12 @@ class utilityPane(QWidget):
 		self.stm = stmSender(self)
 		self.stm.setName.connect(self.ui.bootFile.setText)
 		self.stm.setSize.connect(self.ui.bootSize.setText)
-		self.ui.bootSelect.clicked.connect(lambda: self.stm.selectFile(QFileDialog().getOpenFileName(directory=self.stm.dir)))
+		self.ui.bootSelect.clicked.connect(lambda: self.stm.loadFile(QFileDialog().getOpenFileName(directory=self.stm.dir)))
 		self.ui.sendBoot.clicked.connect(self.stm.sendFile)
 		self.ui.bootLoaderProgressBar.reset()
 		self.ui.bootLoaderProgressBar.setMaximum(1000)
 		self.stm.setProgress.connect(lambda n: self.ui.bootLoaderProgressBar.setValue(n*1000))
+		self.stm.loadProgress.connect(lambda n: self.ui.bootLoaderProgressBar.setValue(n*1000))
 		self.stm.setAction.connect(lambda: self.ui.sendBoot.setText)
 		self.stm.verbose = self.ui.verbose.isChecked()
 		self.ui.verbose.stateChanged.connect(self.stm.setVerbose)
@@ -75,23 +50,25 @@ class utilityPane(QWidget):
  		self.jam = jamSender(self)
 		self.jam.setName.connect(self.ui.jamFile.setText)
 		self.jam.setSize.connect(self.ui.jamSize.setText)
- 		self.ui.jamSelect.clicked.connect(lambda: self.jam.selectFile(QFileDialog().getOpenFileName(directory=self.jam.dir)))
+ 		self.ui.jamSelect.clicked.connect(lambda: self.jam.loadFile(QFileDialog().getOpenFileName(directory=self.jam.dir)))
 		self.ui.sendJam.clicked.connect(self.jam.sendJam)
 		self.ui.sendFile.clicked.connect(self.jam.sendFile)
 		self.ui.jamLoaderProgressBar.reset()
 		self.ui.jamLoaderProgressBar.setMaximum(1000)
 		self.jam.setProgress.connect(lambda n: self.ui.jamLoaderProgressBar.setValue(n*1000))
+		self.jam.loadProgress.connect(lambda n: self.ui.jamLoaderProgressBar.setValue(n*1000))
 		self.jam.setAction.connect(lambda: self.ui.sendJam.setText)
 
 		# Transfer EEPROM Script
  		self.eeprom = eepromTransfer(self)
 		self.eeprom.setName.connect(self.ui.eepromFile.setText)
 		self.eeprom.setSize.connect(self.ui.eepromSize.setText)
- 		self.ui.eepromSelect.clicked.connect(lambda: self.eeprom.selectFile(QFileDialog().getOpenFileName(directory=self.eeprom.dir)))
+ 		self.ui.eepromSelect.clicked.connect(lambda: self.eeprom.loadFile(QFileDialog().getOpenFileName(directory=self.eeprom.dir)))
 		self.ui.sendEeprom.clicked.connect(self.eeprom.sendFile)
 		self.ui.eepromLoaderProgressBar.reset()
 		self.ui.eepromLoaderProgressBar.setMaximum(1000)
 		self.eeprom.setProgress.connect(lambda n: self.ui.eepromLoaderProgressBar.setValue(n*1000))
+		self.eeprom.loadProgress.connect(lambda n: self.ui.eepromLoaderProgressBar.setValue(n*1000))
 		self.eeprom.setAction.connect(lambda: self.ui.sendEeprom.setText)
 		self.eeprom.scriptOk.connect(self.crcStatus)
 		self.eeprom.imageLoaded.connect(self.eeprom.checkScriptCrc)